@@ -0,0 +1,140 @@
+import math
+
+# Rectangles are (west, south, east, north) in degrees; the CROUS API and
+# !setlocation use two corner points instead, see to_rect and to_bounds.
+DEFAULT_AREA = (1.9954155920674, 48.33343022631068, 2.7246331213642754, 49.095452162534826)
+GRID_SIZE = 0.05  # Degrees per grid cell of the subscriber index
+MERGE_SLACK = 1.25  # Merge two areas when their bounding box is at most this much larger than they are
+MAX_AREAS = 5  # Search areas per guild or DM user
+MAX_SPAN = 5  # Degrees of longitude or latitude a search area may cover
+
+
+def to_rect(lon1, lat1, lon2, lat2):
+    """Normalize two corner points into a (west, south, east, north) rectangle"""
+    return (min(lon1, lon2), min(lat1, lat2), max(lon1, lon2), max(lat1, lat2))
+
+
+def area_error(rect):
+    """Why a rectangle can't be used as a search area, or None if it can"""
+    west, south, east, north = rect
+    if not all(math.isfinite(value) for value in rect):
+        return "Coordinates must be numbers."
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        return "Longitudes must be between -180 and 180 and latitudes between -90 and 90."
+    if east - west > MAX_SPAN or north - south > MAX_SPAN:
+        return f"A search area can span at most {MAX_SPAN}° of longitude and latitude."
+    return None
+
+
+def to_bounds(rect):
+    """Turn a rectangle into the north-west/south-east bounds used by crous_api"""
+    west, south, east, north = rect
+    return {"lon1": west, "lat1": north, "lon2": east, "lat2": south}
+
+
+def contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+def surface(rect):
+    return (rect[2] - rect[0]) * (rect[3] - rect[1])
+
+
+def union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def overlap(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    return max(width, 0) * max(height, 0)
+
+
+def covering_areas(rects):
+    """Smallest set of rectangles to query so that every given rectangle is covered.
+
+    Duplicates and rectangles inside another one are dropped, then pairs
+    whose bounding box adds little extra surface (MERGE_SLACK) are merged
+    so overlapping areas cost one query instead of two.
+    """
+    cover = []
+    for rect in sorted(set(rects), key=surface, reverse=True):
+        if not any(contains(other, rect) for other in cover):
+            cover.append(rect)
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(cover)):
+            for j in range(i + 1, len(cover)):
+                a, b = cover[i], cover[j]
+                box = union(a, b)
+                if surface(box) <= MERGE_SLACK * (surface(a) + surface(b) - overlap(a, b)):
+                    cover = [rect for k, rect in enumerate(cover) if k not in (i, j) and not contains(box, rect)]
+                    cover.append(box)
+                    merged = True
+                    break
+            if merged:
+                break
+    return cover
+
+
+def item_location(item):
+    """(lon, lat) of a CROUS item's residence, or None if the API didn't give one"""
+    location = (item.get('residence') or {}).get('location') or {}
+    if location.get('lon') is None or location.get('lat') is None:
+        return None
+    return location['lon'], location['lat']
+
+
+class AreaIndex:
+    """Grid index from coordinates to the subscribers whose areas contain them.
+
+    Subscribers sharing an area share one entry, so building the index and
+    routing an item cost grows with distinct areas, not with subscribers.
+    """
+
+    def __init__(self, cell=GRID_SIZE):
+        self.cell = cell
+        self._cells = {}  # (column, row) -> [rectangle]
+        self._subscribers = {}  # Rectangle -> set of subscribers
+        self.covering = []  # Rectangles polled each cycle
+
+    def _cell_range(self, rect):
+        west, south, east, north = rect
+        for column in range(math.floor(west / self.cell), math.floor(east / self.cell) + 1):
+            for row in range(math.floor(south / self.cell), math.floor(north / self.cell) + 1):
+                yield column, row
+
+    def build(self, subscriptions):
+        """Index a dict of subscriber -> list of rectangles"""
+        self._cells = {}
+        self._subscribers = {}
+        for subscriber, rects in subscriptions.items():
+            for rect in rects:
+                self._subscribers.setdefault(rect, set()).add(subscriber)
+        for rect in self._subscribers:
+            for key in self._cell_range(rect):
+                self._cells.setdefault(key, []).append(rect)
+        self.covering = covering_areas(self._subscribers)
+
+    def areas_at(self, lon, lat):
+        """Subscriber areas containing a point, as a hashable key for subscribers_of"""
+        key = (math.floor(lon / self.cell), math.floor(lat / self.cell))
+        return frozenset(rect for rect in self._cells.get(key, ())
+                         if rect[0] <= lon <= rect[2] and rect[1] <= lat <= rect[3])
+
+    def areas_within(self, cover):
+        """Subscriber areas inside a covering rectangle, for items without coordinates"""
+        return frozenset(rect for rect in self._subscribers if contains(cover, rect))
+
+    def subscribers_of(self, rects):
+        """Subscribers owning any of the given areas"""
+        return set().union(*(self._subscribers[rect] for rect in rects))
+
+    def subscribers_at(self, lon, lat):
+        """Subscribers with an area containing a point"""
+        return self.subscribers_of(self.areas_at(lon, lat))
+
+    def area_count(self):
+        return len(self._subscribers)
@@ -0,0 +1,144 @@
+import asyncio
+import queue
+import threading
+import db_manager
+
+MAX_BATCH = 64  # Requests picked up by the worker in one go
+
+_requests = queue.Queue()  # (function, args, is_write, future, loop) or None to stop
+_worker = None
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():
+        return  # Caller went away (cancelled)
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _deliver(request, result=None, error=None):
+    _, _, _, future, loop = request
+    try:
+        loop.call_soon_threadsafe(_resolve, future, result, error)
+    except RuntimeError:
+        pass  # Event loop already closed
+
+
+def _run_writes(writes):
+    """Run consecutive writes in one transaction.
+
+    If the batch fails, it is rolled back and each write is retried in its
+    own transaction so only the faulty request gets the error.
+    """
+    try:
+        results = []
+        with db_manager.transaction():
+            for func, args, _, _, _ in writes:
+                results.append(func(*args))
+    except Exception:
+        for request in writes:
+            try:
+                with db_manager.transaction():
+                    result = request[0](*request[1])
+                _deliver(request, result)
+            except Exception as e:
+                _deliver(request, error=e)
+        return
+    for request, result in zip(writes, results):
+        _deliver(request, result)
+
+
+def _run():
+    """Worker thread: owns the SQLite connection and serves every request"""
+    while True:
+        batch = [_requests.get()]
+        while batch[-1] is not None and len(batch) < MAX_BATCH:
+            try:
+                batch.append(_requests.get_nowait())
+            except queue.Empty:
+                break
+
+        writes = []
+        for request in batch:
+            if request is not None and request[2]:
+                writes.append(request)
+                continue
+            if writes:
+                _run_writes(writes)
+                writes = []
+            if request is None:
+                db_manager.close_connection()
+                return
+            try:
+                _deliver(request, request[0](*request[1]))
+            except Exception as e:
+                _deliver(request, error=e)
+        if writes:
+            _run_writes(writes)
+
+
+async def _submit(func, args, is_write):
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=_run, name="db-worker", daemon=True)
+        _worker.start()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _requests.put((func, args, is_write, future, loop))
+    return await future
+
+
+async def close():
+    """Finish pending requests, then close the connection and stop the worker"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        _requests.put(None)
+        await asyncio.to_thread(_worker.join)
+    _worker = None
+
+
+def _async(func, is_write=False):
+    """Wrap a db_manager function so it runs on the worker thread"""
+    async def wrapper(*args):
+        return await _submit(func, args, is_write)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+# Async versions of db_manager, for use from the event loop.
+# Writes that queue up while the worker is busy share a single commit.
+init_db = _async(db_manager.init_db)  # Manages its own commits
+add_to_queue = _async(db_manager.add_to_queue, is_write=True)
+add_many_to_queue = _async(db_manager.add_many_to_queue, is_write=True)
+remove_from_queue = _async(db_manager.remove_from_queue, is_write=True)
+remove_many_from_queue = _async(db_manager.remove_many_from_queue, is_write=True)
+claim_user = _async(db_manager.claim_user, is_write=True)
+release_claim = _async(db_manager.release_claim, is_write=True)
+clear_claims = _async(db_manager.clear_claims, is_write=True)
+get_queue = _async(db_manager.get_queue)
+is_in_queue = _async(db_manager.is_in_queue)
+add_dm_user = _async(db_manager.add_dm_user, is_write=True)
+add_many_dm_users = _async(db_manager.add_many_dm_users, is_write=True)
+remove_dm_user = _async(db_manager.remove_dm_user, is_write=True)
+get_all_dm_users = _async(db_manager.get_all_dm_users)
+set_digest_window = _async(db_manager.set_digest_window, is_write=True)
+get_digest_windows = _async(db_manager.get_digest_windows)
+is_dm_user = _async(db_manager.is_dm_user)
+save_dm_channel = _async(db_manager.save_dm_channel, is_write=True)
+save_many_dm_channels = _async(db_manager.save_many_dm_channels, is_write=True)
+get_all_dm_channels = _async(db_manager.get_all_dm_channels)
+get_seen = _async(db_manager.get_seen)
+update_seen = _async(db_manager.update_seen, is_write=True)
+add_search_area = _async(db_manager.add_search_area, is_write=True)
+replace_search_areas = _async(db_manager.replace_search_areas, is_write=True)
+remove_search_area = _async(db_manager.remove_search_area, is_write=True)
+get_search_areas = _async(db_manager.get_search_areas)
+set_crous_filter = _async(db_manager.set_crous_filter, is_write=True)
+clear_crous_filter = _async(db_manager.clear_crous_filter, is_write=True)
+get_crous_filters = _async(db_manager.get_crous_filters)
+add_watch = _async(db_manager.add_watch, is_write=True)
+remove_watch = _async(db_manager.remove_watch, is_write=True)
+get_watches = _async(db_manager.get_watches)
@@ -0,0 +1,428 @@
+import copy
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from bs4 import BeautifulSoup
+import db_manager
+from queue_index import QueueIndex, normalize
+from seen_store import SeenStore
+from crous_api import item_digest
+from areas import AreaIndex
+from filters import FilterIndex, item_features
+from watches import WatchIndex
+import reservation
+from studefi_parser import parse_listing, find_reservation_link, parse_form, absolute_url
+
+FIXTURES_DIR = "fixtures"
+
+
+def load_fixture(name):
+    with open(f"{FIXTURES_DIR}/{name}", encoding="utf-8") as f:
+        return f.read()
+
+
+def timed(func, *args, runs=200):
+    """Return (result, mean seconds per call)"""
+    result = func(*args)
+    start = time.perf_counter()
+    for _ in range(runs):
+        func(*args)
+    return result, (time.perf_counter() - start) / runs
+
+
+# Reference BeautifulSoup implementations, as the bot used to parse pages
+
+def bs4_listing(html):
+    soup = BeautifulSoup(html, "html.parser")
+    residences = []
+    for elem in soup.find_all("div", class_="col-sm-6 list-res-elem"):
+        name_tag = elem.find("div", class_="list-res-link")
+        name_tag = name_tag.find("a") if name_tag else None
+        if not name_tag:
+            continue
+        img_tag = elem.find("img", class_="dispoRes")
+        available = bool(img_tag) and "non_disponibles" not in img_tag.get("src", "")
+        residences.append((name_tag.get_text(strip=True), name_tag.get("href", ""), available))
+    return residences
+
+
+def bs4_reservation_link(html):
+    soup = BeautifulSoup(html, "html.parser")
+    for a in soup.find_all("a", class_="button mini-button"):
+        if "Réserver en ligne" in a.get_text() or "srv=Reservation" in a.get("href", ""):
+            return absolute_url(a.get("href")) if a.get("href") else None
+    return None
+
+
+def bs4_form(html, form_id="form1"):
+    soup = BeautifulSoup(html, "html.parser")
+    form = soup.find("form", id=form_id)
+    if not form:
+        return None
+    fields = {}
+    for inp in form.find_all("input"):
+        if inp.get("name") and inp.get("name") not in fields:
+            fields[inp.get("name")] = inp.get("value", "")
+    return fields, absolute_url(form.get("action"))
+
+
+def bench_studefi_parser():
+    """Check the streaming extractors against BeautifulSoup and time both"""
+    cases = [
+        ("studefi_main.html", parse_listing, bs4_listing),
+        ("studefi_residence.html", find_reservation_link, bs4_reservation_link),
+        ("studefi_form1.html", parse_form, bs4_form),
+    ]
+    print("\n⏱️ Studefi page parsing (ms per page)")
+    for fixture, fast, reference in cases:
+        html = load_fixture(fixture)
+        fast_result, fast_time = timed(fast, html)
+        ref_result, ref_time = timed(reference, html)
+        status = "✅" if fast_result == ref_result else "❌ MISMATCH"
+        print(f"{status} {fixture}: extractor {fast_time * 1000:.3f} ms, "
+              f"BeautifulSoup {ref_time * 1000:.3f} ms ({ref_time / fast_time:.1f}x)")
+
+
+# Reference db_manager functions, opening a connection per call as before
+
+def old_add_to_queue(db_path, user_id, residence, email, priority=1):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("INSERT INTO studefi_queue (user_id, residence, email, priority) VALUES (?, ?, ?, ?)", (user_id, residence, email, priority))
+    conn.commit()
+    conn.close()
+
+
+def old_get_queue(db_path):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("SELECT user_id, residence, email, timestamp, priority FROM studefi_queue ORDER BY priority DESC, timestamp ASC")
+    queue = c.fetchall()
+    conn.close()
+    return queue
+
+
+def old_is_in_queue(db_path, user_id):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM studefi_queue WHERE user_id = ?", (user_id,))
+    exists = c.fetchone() is not None
+    conn.close()
+    return exists
+
+
+def bench_db(queued_users=10000):
+    """Time queue operations with the old and new db_manager at a given queue size"""
+    entries = [(i, f"Residence {i % 60}", f"user{i}@example.com", 1 + i % 3) for i in range(queued_users)]
+    print(f"\n⏱️ Queue operations with {queued_users} queued users (ms per call)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = os.path.join(tmp, "old.db")
+        conn = sqlite3.connect(old_path)
+        conn.execute("CREATE TABLE studefi_queue (user_id INTEGER, residence TEXT, email TEXT, "
+                     "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, priority INTEGER DEFAULT 1)")
+        conn.executemany("INSERT INTO studefi_queue (user_id, residence, email, priority) VALUES (?, ?, ?, ?)", entries)
+        conn.commit()
+        conn.close()
+
+        db_manager.close_connection()
+        db_manager.DB_PATH = os.path.join(tmp, "new.db")
+        db_manager.init_db()
+        db_manager.add_many_to_queue(entries)
+
+        ops = [
+            ("add_to_queue", lambda i: old_add_to_queue(old_path, queued_users + i, "Residence", "a@b.c"),
+             lambda i: db_manager.add_to_queue(queued_users + i, "Residence", "a@b.c"), 200),
+            ("get_queue", lambda i: old_get_queue(old_path), lambda i: db_manager.get_queue(), 20),
+            ("is_in_queue", lambda i: old_is_in_queue(old_path, i * 37 % queued_users),
+             lambda i: db_manager.is_in_queue(i * 37 % queued_users), 500),
+        ]
+        for name, old, new, runs in ops:
+            start = time.perf_counter()
+            for i in range(runs):
+                old(i)
+            old_time = (time.perf_counter() - start) / runs
+            start = time.perf_counter()
+            for i in range(runs):
+                new(i)
+            new_time = (time.perf_counter() - start) / runs
+            print(f"{name}: before {old_time * 1000:.3f} ms, after {new_time * 1000:.3f} ms "
+                  f"({old_time / new_time:.1f}x)")
+        db_manager.close_connection()
+
+
+def matches_residence(q_residence, name):
+    """Residence matching as it was before QueueIndex"""
+    q_residence = q_residence.lower()
+    name = name.lower()
+    return q_residence == "first available" or q_residence in name or name in q_residence
+
+
+def scan_queue(queue, name):
+    """Reference matching: the first queued user whose choice matches, as before"""
+    for user_id, q_residence, email, _, _ in queue:
+        if matches_residence(q_residence.lower(), name.lower()):
+            return user_id
+    return None
+
+
+def bench_queue_index(queued_users=5000):
+    """Check QueueIndex against a queue scan and time matching a residence"""
+    names = [name for name, _, _ in parse_listing(load_fixture("studefi_main.html"))]
+    queue = sorted(
+        ((i, "First Available" if i % 1000 == 999 else names[i * 7 % (len(names) // 3)], f"user{i}@example.com",
+          f"2026-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}", 1 + i % 3) for i in range(queued_users)),
+        key=lambda row: (-row[4], row[3]))
+    print(f"\n⏱️ Matching residences with {queued_users} queued users (ms per residence)")
+
+    index = QueueIndex()
+    index.update_residences(names)
+    build_start = time.perf_counter()
+    index.load(queue)
+    build_time = time.perf_counter() - build_start
+
+    def indexed(name):
+        row = next(index.candidates(name), None)
+        return row[0] if row else None
+
+    scan_results, scan_time = timed(lambda: [scan_queue(queue, name) for name in names], runs=5)
+    index_results, index_time = timed(lambda: [indexed(name) for name in names], runs=50)
+    status = "✅" if scan_results == index_results else "❌ MISMATCH"
+    print(f"{status} scan {scan_time / len(names) * 1000:.3f} ms, index {index_time / len(names) * 1000:.4f} ms "
+          f"({scan_time / index_time:.0f}x), index built in {build_time * 1000:.1f} ms")
+
+
+def bench_submission_payloads(attempts=2000):
+    """Time building a reservation's payloads per attempt vs merging into a template"""
+    form1, _ = parse_form(load_fixture("studefi_form1.html"))
+    print(f"\n⏱️ Reservation payloads (µs per attempt)")
+
+    def rebuild():
+        payload1, payload2 = reservation.build_submission_template("user@example.com")
+        for payload, hidden in ((payload1, reservation.FORM1_HIDDEN), (payload2, reservation.FORM2_HIDDEN)):
+            for field in hidden:
+                payload[field] = form1.get(field, "")
+        return payload1, payload2
+
+    def from_template():
+        template1, template2 = reservation._get_submission(1, "user@example.com")
+        return (reservation._merge_hidden(template1, form1, reservation.FORM1_HIDDEN),
+                reservation._merge_hidden(template2, form1, reservation.FORM2_HIDDEN))
+
+    built, build_time = timed(rebuild, runs=attempts)
+    merged, merge_time = timed(from_template, runs=attempts)
+    status = "✅" if built == merged else "❌ MISMATCH"
+    print(f"{status} rebuilt {build_time * 1e6:.1f} µs, template {merge_time * 1e6:.1f} µs "
+          f"({build_time / merge_time:.1f}x)")
+
+
+def replay_polls(polls, interval=5):
+    """Count alerts sent by the old replace-the-set dedup and by SeenStore over a poll sequence"""
+    old_seen = set()
+    old_alerts = 0
+    store = SeenStore("replay")
+    new_alerts = 0
+    for i, (current, complete) in enumerate(polls):
+        old_alerts += len(current - old_seen)
+        old_seen = current if complete else old_seen | current
+        new_alerts += len(store.update(current, complete, now=i * interval)[0])
+    return old_alerts, new_alerts, len(store)
+
+
+def flapping_polls(listings=60, polls=2000, blip_rate=0.05, churn_rate=0.002, seed=1):
+    """Poll results where listings blip out for a poll or two and slowly churn.
+
+    Returns (polls, real arrivals): each poll is (set of IDs, complete).
+    """
+    rng = random.Random(seed)
+    live = set(range(listings))
+    next_id = listings
+    arrivals = listings
+    result = []
+    for _ in range(polls):
+        for item_id in list(live):
+            if rng.random() < churn_rate:  # Listing taken, a new one appears
+                live.discard(item_id)
+                live.add(next_id)
+                next_id += 1
+                arrivals += 1
+        complete = rng.random() > 0.05
+        current = {item_id for item_id in live if rng.random() > blip_rate}
+        if not complete:  # A page failed: a contiguous slice is missing
+            current -= set(sorted(live)[-24:])
+        result.append((current, complete))
+    return result, arrivals
+
+
+def bench_seen_store():
+    """Replay flapping poll sequences and count duplicate alerts"""
+    print("\n🔁 Flapping replay (alerts sent, duplicates beyond real arrivals)")
+    for blip_rate in (0.01, 0.05, 0.2):
+        polls, arrivals = flapping_polls(blip_rate=blip_rate)
+        old_alerts, new_alerts, tracked = replay_polls(polls)
+        status = "✅" if new_alerts == arrivals else "❌"
+        print(f"{status} blip rate {blip_rate:.0%}: {arrivals} real arrivals, "
+              f"before {old_alerts} alerts ({old_alerts - arrivals} duplicates), "
+              f"after {new_alerts} alerts ({new_alerts - arrivals} duplicates), {tracked} items tracked")
+
+
+def fake_item(item_id, rent):
+    return {
+        "id": item_id, "label": f"Logement {item_id}", "code": f"C{item_id}", "reference": f"R{item_id}",
+        "residence": {"label": f"Résidence {item_id % 40}", "address": f"{item_id} rue de Paris"},
+        "roomCount": 1, "bedroomCount": 1, "area": {"min": 18, "max": 18}, "available": True,
+        "occupationModes": [{"type": "alone", "rent": {"min": rent, "max": rent}}],
+        "equipments": [{"label": "Kitchenette"}, {"label": "Douche"}, {"label": "Wi-Fi"}],
+    }
+
+
+def bench_change_detection(listings=3000, change_rate=0.01, polls=20):
+    """Classify items as new, changed or unchanged by digest vs by deep comparison"""
+    rng = random.Random(2)
+    items = [fake_item(i, 40000) for i in range(listings)]
+    print(f"\n⏱️ Change detection over {listings} listings (ms per poll)")
+
+    store = SeenStore("bench")
+    store.update({item["id"]: item_digest(item) for item in items}, now=0)
+    snapshots = {item["id"]: copy.deepcopy(item) for item in items}
+    digest_time = deep_time = 0
+    mismatches = 0
+    for poll in range(1, polls + 1):
+        for item in rng.sample(items, int(listings * change_rate)):
+            item["occupationModes"][0]["rent"]["min"] += 100
+        start = time.perf_counter()
+        _, changed = store.update({item["id"]: item_digest(item) for item in items}, now=poll)
+        digest_time += time.perf_counter() - start
+        start = time.perf_counter()
+        deep_changed = [item["id"] for item in items if snapshots[item["id"]] != item]
+        snapshots = {item["id"]: copy.deepcopy(item) for item in items}
+        deep_time += time.perf_counter() - start
+        mismatches += set(changed) != set(deep_changed)
+    status = "✅" if not mismatches else "❌ MISMATCH"
+    print(f"{status} digests {digest_time / polls * 1000:.2f} ms (8 bytes kept per item), "
+          f"deep comparison {deep_time / polls * 1000:.2f} ms (full copy kept per item)")
+
+
+def bench_area_index(subscribers=10000, distinct_areas=50, items=500):
+    """Route items to subscribers with AreaIndex vs checking every subscriber's areas"""
+    rng = random.Random(3)
+    rects = []
+    for _ in range(distinct_areas):
+        west, south = rng.uniform(1.9, 2.6), rng.uniform(48.3, 49.0)
+        rects.append((west, south, west + rng.uniform(0.05, 0.3), south + rng.uniform(0.05, 0.3)))
+    subscriptions = {("user", i): [rects[i % distinct_areas]] for i in range(subscribers)}
+    points = [(rng.uniform(1.9, 2.9), rng.uniform(48.3, 49.3)) for _ in range(items)]
+    print(f"\n⏱️ Routing {items} items to {subscribers} subscribers over {distinct_areas} distinct areas")
+
+    index = AreaIndex()
+    build_start = time.perf_counter()
+    index.build(subscriptions)
+    build_time = time.perf_counter() - build_start
+
+    def naive():
+        return [{subscriber for subscriber, areas in subscriptions.items()
+                 if any(r[0] <= lon <= r[2] and r[1] <= lat <= r[3] for r in areas)} for lon, lat in points]
+
+    naive_result, naive_time = timed(naive, runs=2)
+    indexed_result, indexed_time = timed(lambda: [index.subscribers_at(lon, lat) for lon, lat in points], runs=10)
+    status = "✅" if naive_result == indexed_result else "❌ MISMATCH"
+    print(f"{status} per subscriber {naive_time * 1000:.1f} ms, index {indexed_time * 1000:.1f} ms "
+          f"({naive_time / indexed_time:.0f}x), built in {build_time * 1000:.1f} ms, "
+          f"{len(index.covering)} area(s) queried")
+
+
+def bench_filter_index(subscribers=10000, items=300):
+    """Match items against subscriber filters with FilterIndex vs one check per subscriber"""
+    rng = random.Random(4)
+    labels = ["wi-fi", "kitchenette", "douche", "parking", "laverie"]
+    filters = {("user", i): (rng.choice([None, 30000, 40000, 50000, 60000]), rng.choice([None, 12, 18, 25]),
+                             rng.choice([None, 1, 2]), frozenset(rng.sample(labels, rng.randint(0, 2))))
+               for i in range(subscribers)}
+    batch = []
+    for i in range(items):
+        item = fake_item(i, rng.choice([25000, 35000, 45000, 65000]))
+        item["area"] = {"min": rng.choice([9, 18, 30])}
+        item["equipments"] = [{"label": label.capitalize()} for label in rng.sample(labels, rng.randint(1, 5))]
+        batch.append(item)
+    everyone = set(filters)
+    print(f"\n⏱️ Filtering {items} items for {subscribers} subscribers")
+
+    def naive():
+        routes = {}
+        for item in batch:
+            rent, area, bedrooms, equipment = item_features(item)
+            for subscriber, (max_rent, min_area, min_bedrooms, required) in filters.items():
+                if ((max_rent is None or rent <= max_rent) and (min_area is None or area >= min_area)
+                        and (min_bedrooms is None or bedrooms >= min_bedrooms) and required <= equipment):
+                    routes.setdefault(subscriber, []).append(item["id"])
+        return routes
+
+    def indexed():
+        keyed = {}
+        for item in batch:
+            keyed.setdefault(index.matching_mask(item), []).append(item["id"])
+        routes = {}
+        for mask, item_ids in keyed.items():
+            for subscriber in index.select(mask, everyone):
+                routes.setdefault(subscriber, []).extend(item_ids)
+        return routes
+
+    index = FilterIndex()
+    index.build(filters)
+    naive_result, naive_time = timed(naive, runs=2)
+    indexed_result, indexed_time = timed(indexed, runs=2)
+    mask_result, mask_time = timed(lambda: {index.matching_mask(item) for item in batch}, runs=20)
+    same = {k: sorted(v) for k, v in naive_result.items()} == {k: sorted(v) for k, v in indexed_result.items()}
+    status = "✅" if same else "❌ MISMATCH"
+    print(f"{status} per subscriber {naive_time * 1000:.0f} ms, index {indexed_time * 1000:.0f} ms "
+          f"({naive_time / indexed_time:.1f}x); {len(mask_result)} distinct filter results, "
+          f"matching took {mask_time * 1000:.2f} ms")
+
+
+def bench_watch_index(subscribers=10000, residences=60, events=200):
+    """Route Studefi availability events to watchers with WatchIndex vs a scan of every watch"""
+    rng = random.Random(5)
+    names = [f"Résidence {i} - Étudiants" for i in range(residences)]
+    watches = {("user", i): {normalize(name) for name in rng.sample(names, rng.randint(1, 2))}
+               for i in range(subscribers)}
+    batch = [rng.sample(names, rng.randint(1, 3)) for _ in range(events)]
+    print(f"\n⏱️ Routing {events} Studefi events for {subscribers} watchers")
+
+    def naive():
+        routes = []
+        for event in batch:
+            for name in event:
+                key = normalize(name)
+                routes.append({subscriber for subscriber, keys in watches.items()
+                               if any(watched in key or key in watched for watched in keys)})
+        return routes
+
+    index = WatchIndex()
+    index.build(watches)
+    naive_result, naive_time = timed(naive, runs=1)
+    indexed_result, indexed_time = timed(lambda: [set(index.watchers(name)) for event in batch for name in event],
+                                         runs=5)
+    status = "✅" if naive_result == indexed_result else "❌ MISMATCH"
+    sent = sum(len(route) for route in indexed_result)
+    print(f"{status} scan {naive_time * 1000:.0f} ms, index {indexed_time * 1000:.2f} ms "
+          f"({naive_time / indexed_time:.0f}x); {sent} alerts instead of "
+          f"{subscribers * len(indexed_result)} broadcast")
+
+
+if __name__ == "__main__":
+    print(f"🤖 Starting benchmarks at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 50)
+    bench_studefi_parser()
+    bench_db()
+    bench_queue_index()
+    bench_submission_payloads()
+    bench_seen_store()
+    bench_change_detection()
+    bench_area_index()
+    bench_filter_index()
+    bench_watch_index()
+    print("\n" + "=" * 50)
+    print("✨ Benchmarks completed")
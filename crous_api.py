@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import math
+from http_client import get_session
+from scheduler import crous_schedule
+
+API_URL = "https://trouverunlogement.lescrous.fr/api/fr/search/41"
+
+PAGE_SIZE = 24
+MAX_PAGES = 10  # Ceiling on pages fetched per search
+TILE_PAGES = 2  # Pages a tile may need before it is split into quadrants
+MAX_TILE_DEPTH = 5  # Maximum quadtree depth below the search area
+PROBE_SIZE = 5  # Items requested by the change probe
+FULL_REFRESH_POLLS = 20  # Force a full fetch after this many unchanged probes
+
+_tile_layouts = {}  # Search area -> {tile path: last total}
+_probe_snapshots = {}  # Search area -> ((total, top item digests), unchanged probes)
+_area_results = {}  # Search area -> (items, total, complete) of its last full fetch
+
+stats = {
+    "probes": 0,
+    "full_fetches": 0,
+}
+
+
+def get_payload(bounds, page=1, page_size=PAGE_SIZE, aggregation=True):
+    """Generate the API payload for a search area"""
+    return {
+        "idTool":
+        41,
+        "need_aggregation":
+        aggregation,
+        "page":
+        page,
+        "pageSize":
+        page_size,
+        "sector":
+        None,
+        "occupationModes": [],
+        "location": [{
+            "lon": bounds["lon1"],
+            "lat": bounds["lat1"]
+        }, {
+            "lon": bounds["lon2"],
+            "lat": bounds["lat2"]
+        }],
+        "residence":
+        None,
+        "precision":
+        4,
+        "equipment": [],
+        "price": {
+            "max": 10000000
+        },
+        "area": {
+            "min": 0
+        },
+        "toolMechanism":
+        "residual"
+    }
+
+
+async def fetch_page(bounds, page=1):
+    """Fetch one result page. Returns (items, total) or None on failure"""
+    response = await get_session().post(API_URL, json=get_payload(bounds, page))
+    crous_schedule.record_response(response.status_code, response.headers.get("Retry-After"))
+    if response.status_code != 200:
+        print(f"API request for page {page} failed with status: {response.status_code}")
+        return None
+    results = response.json().get('results', {})
+    return results.get('items', []), results.get('total', {}).get('value', 0)
+
+
+async def fetch_all_items(bounds, max_pages=MAX_PAGES, first=None):
+    """Fetch every result page of a search area.
+
+    The first page gives the total; the remaining pages (up to max_pages)
+    are requested concurrently and merged, deduplicated by item id.
+    Pass first=(items, total) if page 1 was already fetched.
+    Returns (items, total, complete) or None if the first page failed.
+    complete is False when a later page failed or max_pages was reached.
+    """
+    if first is None:
+        first = await fetch_page(bounds, 1)
+    if first is None:
+        return None
+    items, total = first
+
+    page_count = math.ceil(total / PAGE_SIZE)
+    complete = page_count <= max_pages
+    pages = await asyncio.gather(
+        *(fetch_page(bounds, page) for page in range(2, min(page_count, max_pages) + 1)),
+        return_exceptions=True)
+
+    merged = {item.get('id'): item for item in items}
+    for page in pages:
+        if isinstance(page, Exception) or page is None:
+            if isinstance(page, Exception):
+                print(f"Error fetching API page: {page}")
+            complete = False
+            continue
+        for item in page[0]:
+            merged.setdefault(item.get('id'), item)
+    return list(merged.values()), total, complete
+
+
+def _area_key(bounds):
+    return tuple(sorted(bounds.items()))
+
+
+def _tile_bounds(bounds, path):
+    """Bounds of a quadtree tile. Each path digit picks a quadrant:
+    0 north-west, 1 north-east, 2 south-west, 3 south-east."""
+    tile = dict(bounds)
+    for quadrant in path:
+        mid_lon = (tile["lon1"] + tile["lon2"]) / 2
+        mid_lat = (tile["lat1"] + tile["lat2"]) / 2
+        if quadrant in "01":
+            tile["lat2"] = mid_lat
+        else:
+            tile["lat1"] = mid_lat
+        if quadrant in "02":
+            tile["lon2"] = mid_lon
+        else:
+            tile["lon1"] = mid_lon
+    return tile
+
+
+async def _fetch_tile(bounds, path, leaves):
+    """Fetch a tile, splitting it recursively while it is saturated.
+
+    Records every leaf tile that was queried in leaves as {path: total}.
+    Returns (items, complete).
+    """
+    tile = _tile_bounds(bounds, path)
+    first = await fetch_page(tile, 1)
+    if first is None:
+        leaves[path] = None
+        return [], False
+
+    total = first[1]
+    if total > TILE_PAGES * PAGE_SIZE and len(path) < MAX_TILE_DEPTH:
+        children = await asyncio.gather(
+            *(_fetch_tile(bounds, path + quadrant, leaves) for quadrant in "0123"))
+        items = [item for child_items, _ in children for item in child_items]
+        return items, all(child_complete for _, child_complete in children)
+
+    leaves[path] = total
+    fetched = await fetch_all_items(tile, first=first)
+    return fetched[0], fetched[2]
+
+
+def _coarsen(layout):
+    """Merge sibling tiles back into their parent once they are quiet"""
+    merged = dict(layout)
+    parents = {path[:-1] for path in layout if path}
+    for parent in parents:
+        children = [parent + quadrant for quadrant in "0123"]
+        if not all(child in merged for child in children):
+            continue
+        totals = [merged[child] for child in children]
+        if None in totals or sum(totals) > TILE_PAGES * PAGE_SIZE // 2:
+            continue
+        for child in children:
+            del merged[child]
+        merged[parent] = sum(totals)
+    return merged
+
+
+async def fetch_area(bounds):
+    """Fetch every item in a search area using an adaptive quadtree of tiles.
+
+    Tiles are queried in parallel and only saturated tiles are split, so a
+    quiet area costs a single request. The tile layout is remembered
+    between polls and quiet siblings are merged back over time.
+    Returns (items, total, complete) or None if every tile failed.
+    """
+    key = _area_key(bounds)
+    layout = _tile_layouts.pop(key, None) or {"": 0}
+
+    leaves = {}
+    results = await asyncio.gather(
+        *(_fetch_tile(bounds, path, leaves) for path in layout),
+        return_exceptions=True)
+
+    merged = {}
+    complete = True
+    for path, result in zip(layout, results):
+        if isinstance(result, Exception):
+            print(f"Error fetching API tile {path or 'root'}: {result}")
+            leaves.setdefault(path, None)
+            complete = False
+            continue
+        items, tile_complete = result
+        complete = complete and tile_complete
+        for item in items:
+            merged.setdefault(item.get('id'), item)
+
+    if all(total is None for total in leaves.values()):
+        return None
+
+    _tile_layouts[key] = _coarsen({path: total for path, total in leaves.items()})
+
+    total = sum(total for total in leaves.values() if total)
+    return list(merged.values()), total, complete
+
+
+def item_digest(item):
+    """64-bit hash of the fields shown in an alert, to spot listings that changed"""
+    residence = item.get('residence') or {}
+    area = item.get('area') or {}
+    fields = (
+        item.get('label'),
+        residence.get('label'),
+        residence.get('address'),
+        item.get('roomCount'),
+        item.get('bedroomCount'),
+        area.get('min'),
+        area.get('max'),
+        tuple((mode.get('type'), (mode.get('rent') or {}).get('min'), (mode.get('rent') or {}).get('max'))
+              for mode in item.get('occupationModes') or ()),
+        bool(item.get('available')),
+        tuple(eq.get('label') for eq in item.get('equipments') or ()),
+    )
+    digest = hashlib.blake2b(repr(fields).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)  # Fits an SQLite INTEGER
+
+
+async def probe(bounds):
+    """Cheap change probe: (total, (id, digest) of top items) without aggregation, or None"""
+    payload = get_payload(bounds, page_size=PROBE_SIZE, aggregation=False)
+    response = await get_session().post(API_URL, json=payload)
+    crous_schedule.record_response(response.status_code, response.headers.get("Retry-After"))
+    if response.status_code != 200:
+        print(f"API probe failed with status: {response.status_code}")
+        return None
+    results = response.json().get('results', {})
+    top_items = tuple((item.get('id'), item_digest(item)) for item in results.get('items', []))
+    return results.get('total', {}).get('value', 0), top_items
+
+
+async def _poll_area(bounds):
+    """Probe an area and fetch it fully only when the probe sees a change.
+
+    Returns (items, total, complete, changed), reusing the last full fetch
+    when unchanged, or None on failure.
+    """
+    key = _area_key(bounds)
+    stats["probes"] += 1
+    snapshot = await probe(bounds)
+    if snapshot is None:
+        return None
+
+    previous = _probe_snapshots.get(key)
+    cached = _area_results.get(key)
+    if previous and cached and previous[0] == snapshot and previous[1] < FULL_REFRESH_POLLS:
+        _probe_snapshots[key] = (snapshot, previous[1] + 1)
+        return (*cached, False)
+
+    stats["full_fetches"] += 1
+    fetched = await fetch_area(bounds)
+    if fetched is None:
+        return None
+    _probe_snapshots[key] = (snapshot, 0)
+    _area_results[key] = fetched
+    return (*fetched, True)
+
+
+async def poll_areas(areas):
+    """Poll several search areas in parallel, each through the change probe.
+
+    Returns a list of (items, total, complete, changed) per area, with None
+    for areas that failed. Unchanged areas report their last items so the
+    caller always sees every listing. Raises the first error when no area
+    could be polled.
+    """
+    # State is kept for every area polled and only dropped once an area
+    # leaves the set, so each covering area keeps its snapshot and layout
+    polled_keys = {_area_key(bounds) for bounds in areas}
+    for cache in (_tile_layouts, _probe_snapshots, _area_results):
+        for key in [key for key in cache if key not in polled_keys]:
+            del cache[key]
+
+    results = await asyncio.gather(*(_poll_area(bounds) for bounds in areas), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors and all(result is None or isinstance(result, Exception) for result in results):
+        raise errors[0]  # Nothing got through, let the caller back off
+    polled = []
+    for bounds, result in zip(areas, results):
+        if isinstance(result, Exception):
+            print(f"Error polling API area {bounds}: {result}")
+            result = None
+        polled.append(result)
+    return polled
@@ -1,84 +1,308 @@
 import sqlite3
 import os
+from contextlib import contextmanager
 
 DB_PATH = "users.db"
 
+_conn = None
+_tx_depth = 0  # Nesting level of transaction() blocks
+
+# Schema changes applied in order; PRAGMA user_version records how many ran
+MIGRATIONS = [
+    [
+        "CREATE INDEX IF NOT EXISTS idx_queue_user ON studefi_queue (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_queue_order ON studefi_queue (priority DESC, timestamp ASC)",
+    ],
+    [
+        "CREATE TABLE IF NOT EXISTS queue_claims (user_id INTEGER PRIMARY KEY, residence TEXT, "
+        "claimed_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    ],
+    [
+        # item_id has no declared type so CROUS integer IDs and Studefi keys keep their type
+        "CREATE TABLE IF NOT EXISTS seen_items (source TEXT, item_id, PRIMARY KEY (source, item_id)) WITHOUT ROWID",
+    ],
+    [
+        "ALTER TABLE seen_items ADD COLUMN last_seen REAL DEFAULT 0",
+    ],
+    [
+        "ALTER TABLE seen_items ADD COLUMN digest INTEGER",
+    ],
+    [
+        # owner_type is "guild" or "user"; coordinates form a (west, south, east, north) rectangle
+        "CREATE TABLE IF NOT EXISTS search_areas (id INTEGER PRIMARY KEY, owner_type TEXT, owner_id INTEGER, "
+        "west REAL, south REAL, east REAL, north REAL)",
+        "CREATE INDEX IF NOT EXISTS idx_search_areas_owner ON search_areas (owner_type, owner_id)",
+    ],
+    [
+        # max_rent in centimes like the CROUS API; equipment is a comma-separated list of normalized labels
+        "CREATE TABLE IF NOT EXISTS crous_filters (owner_type TEXT, owner_id INTEGER, max_rent INTEGER, "
+        "min_area REAL, min_bedrooms INTEGER, equipment TEXT, PRIMARY KEY (owner_type, owner_id))",
+    ],
+    [
+        # residence_key is the normalized name matched against listings, residence the name as typed
+        "CREATE TABLE IF NOT EXISTS residence_watches (owner_type TEXT, owner_id INTEGER, residence_key TEXT, "
+        "residence TEXT, PRIMARY KEY (owner_type, owner_id, residence_key))",
+        "CREATE INDEX IF NOT EXISTS idx_residence_watches_key ON residence_watches (residence_key)",
+    ],
+]
+
+def get_connection():
+    """Return the process-wide connection, opening and configuring it on first use"""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, cached_statements=256)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+    return _conn
+
+def close_connection():
+    """Close the process-wide connection"""
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+@contextmanager
+def transaction():
+    """Run writes in one transaction, committed when the outermost block exits.
+
+    Nested blocks join the enclosing transaction, so callers can group
+    several write functions into a single commit.
+    """
+    global _tx_depth
+    conn = get_connection()
+    _tx_depth += 1
+    try:
+        if _tx_depth == 1:
+            with conn:
+                yield conn
+        else:
+            yield conn
+    finally:
+        _tx_depth -= 1
+
 def init_db():
     """Initialize the database"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS dm_users
                  (user_id INTEGER PRIMARY KEY)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS dm_channels
+                 (user_id INTEGER PRIMARY KEY, channel_id INTEGER)''')
     c.execute('''CREATE TABLE IF NOT EXISTS studefi_queue
                  (user_id INTEGER, residence TEXT, email TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
     try:
         c.execute('''ALTER TABLE studefi_queue ADD COLUMN priority INTEGER DEFAULT 1''')
     except sqlite3.OperationalError:
         pass
+    try:
+        c.execute('''ALTER TABLE dm_users ADD COLUMN digest_window INTEGER DEFAULT 0''')
+    except sqlite3.OperationalError:
+        pass
     conn.commit()
-    conn.close()
+    migrate()
+
+def migrate():
+    """Apply the schema migrations this database hasn't seen yet"""
+    conn = get_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
 
 def add_to_queue(user_id, residence, email, priority=1):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO studefi_queue (user_id, residence, email, priority) VALUES (?, ?, ?, ?)", (user_id, residence, email, priority))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT INTO studefi_queue (user_id, residence, email, priority) VALUES (?, ?, ?, ?)", (user_id, residence, email, priority))
+
+def add_many_to_queue(entries):
+    """Add (user_id, residence, email, priority) tuples to the queue in one transaction"""
+    with transaction() as conn:
+        conn.executemany("INSERT INTO studefi_queue (user_id, residence, email, priority) VALUES (?, ?, ?, ?)", entries)
 
 def remove_from_queue(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM studefi_queue WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM studefi_queue WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM queue_claims WHERE user_id = ?", (user_id,))
+
+def remove_many_from_queue(user_ids):
+    """Remove several users from the queue in one transaction"""
+    with transaction() as conn:
+        conn.executemany("DELETE FROM studefi_queue WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+        conn.executemany("DELETE FROM queue_claims WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+
+def claim_user(user_id, residence):
+    """Claim a queued user for a reservation; False if another one holds the claim"""
+    with transaction() as conn:
+        c = conn.execute("INSERT OR IGNORE INTO queue_claims (user_id, residence) VALUES (?, ?)", (user_id, residence))
+        return c.rowcount == 1
+
+def release_claim(user_id):
+    """Release a user's claim so later reservations can pick them again"""
+    with transaction() as conn:
+        conn.execute("DELETE FROM queue_claims WHERE user_id = ?", (user_id,))
+
+def clear_claims():
+    """Drop every claim, e.g. those left by reservations interrupted by a restart"""
+    with transaction() as conn:
+        conn.execute("DELETE FROM queue_claims")
 
 def get_queue():
     """Returns list of tuples (user_id, residence, email, timestamp, priority) ordered by priority DESC, timestamp ASC"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT user_id, residence, email, timestamp, priority FROM studefi_queue ORDER BY priority DESC, timestamp ASC")
-    queue = c.fetchall()
-    conn.close()
-    return queue
+    conn = get_connection()
+    c = conn.execute("SELECT user_id, residence, email, timestamp, priority FROM studefi_queue ORDER BY priority DESC, timestamp ASC")
+    return c.fetchall()
 
 def is_in_queue(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM studefi_queue WHERE user_id = ?", (user_id,))
-    exists = c.fetchone() is not None
-    conn.close()
-    return exists
+    conn = get_connection()
+    c = conn.execute("SELECT 1 FROM studefi_queue WHERE user_id = ?", (user_id,))
+    return c.fetchone() is not None
 
 def add_dm_user(user_id):
     """Add a user to DM notifications"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO dm_users (user_id) VALUES (?)", (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO dm_users (user_id) VALUES (?)", (user_id,))
+
+def add_many_dm_users(user_ids):
+    """Add several users to DM notifications in one transaction"""
+    with transaction() as conn:
+        conn.executemany("INSERT OR IGNORE INTO dm_users (user_id) VALUES (?)", [(user_id,) for user_id in user_ids])
 
 def remove_dm_user(user_id):
     """Remove a user from DM notifications"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM dm_users WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM dm_users WHERE user_id = ?", (user_id,))
 
 def get_all_dm_users():
     """Get all users who want DM notifications"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM dm_users")
-    users = {row[0] for row in c.fetchall()}
-    conn.close()
-    return users
+    conn = get_connection()
+    c = conn.execute("SELECT user_id FROM dm_users")
+    return {row[0] for row in c.fetchall()}
+
+def set_digest_window(user_id, window):
+    """Set the DM digest window of a user in seconds (0 disables digests)"""
+    with transaction() as conn:
+        conn.execute("UPDATE dm_users SET digest_window = ? WHERE user_id = ?", (window, user_id))
+
+def get_digest_windows():
+    """Get a dict of user ID -> digest window for users with digests enabled"""
+    conn = get_connection()
+    c = conn.execute("SELECT user_id, digest_window FROM dm_users WHERE digest_window > 0")
+    return dict(c.fetchall())
 
 def is_dm_user(user_id):
     """Check if a user has DM notifications enabled"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM dm_users WHERE user_id = ?", (user_id,))
-    exists = c.fetchone() is not None
-    conn.close()
-    return exists
+    conn = get_connection()
+    c = conn.execute("SELECT 1 FROM dm_users WHERE user_id = ?", (user_id,))
+    return c.fetchone() is not None
+
+def save_dm_channel(user_id, channel_id):
+    """Remember the DM channel ID of a user"""
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO dm_channels (user_id, channel_id) VALUES (?, ?)", (user_id, channel_id))
+
+def save_many_dm_channels(channels):
+    """Remember several (user_id, channel_id) pairs in one transaction"""
+    with transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO dm_channels (user_id, channel_id) VALUES (?, ?)", channels)
+
+def get_all_dm_channels():
+    """Get a dict of user ID -> DM channel ID"""
+    conn = get_connection()
+    c = conn.execute("SELECT user_id, channel_id FROM dm_channels")
+    return dict(c.fetchall())
+
+SEEN_MARKER = ""  # Stored once per source so an empty seen set differs from none
+
+def get_seen(source):
+    """Get a dict of item ID -> (last-seen time, digest) for a source ("crous" or "studefi").
+
+    Returns None if nothing was ever recorded for that source.
+    """
+    conn = get_connection()
+    c = conn.execute("SELECT item_id, last_seen, digest FROM seen_items WHERE source = ?", (source,))
+    seen = {item_id: (last_seen, digest) for item_id, last_seen, digest in c.fetchall()}
+    if SEEN_MARKER not in seen:
+        return None
+    del seen[SEEN_MARKER]
+    return seen
+
+def update_seen(source, seen, removed):
+    """Store (item_id, last_seen, digest) tuples of a source and delete the removed item IDs"""
+    with transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO seen_items (source, item_id) VALUES (?, ?)", (source, SEEN_MARKER))
+        conn.executemany("INSERT OR REPLACE INTO seen_items (source, item_id, last_seen, digest) VALUES (?, ?, ?, ?)",
+                         [(source, item_id, last_seen, digest) for item_id, last_seen, digest in seen])
+        conn.executemany("DELETE FROM seen_items WHERE source = ? AND item_id = ?",
+                         [(source, item_id) for item_id in removed])
+
+def add_search_area(owner_type, owner_id, rect):
+    """Save a (west, south, east, north) search area for a guild or user and return its ID"""
+    with transaction() as conn:
+        c = conn.execute("INSERT INTO search_areas (owner_type, owner_id, west, south, east, north) VALUES (?, ?, ?, ?, ?, ?)",
+                         (owner_type, owner_id, *rect))
+        return c.lastrowid
+
+def replace_search_areas(owner_type, owner_id, rect):
+    """Make a rectangle the only search area of a guild or user and return its ID"""
+    with transaction() as conn:
+        conn.execute("DELETE FROM search_areas WHERE owner_type = ? AND owner_id = ?", (owner_type, owner_id))
+        return add_search_area(owner_type, owner_id, rect)
+
+def remove_search_area(owner_type, owner_id, area_id):
+    """Delete one of an owner's search areas; returns False if it wasn't theirs"""
+    with transaction() as conn:
+        c = conn.execute("DELETE FROM search_areas WHERE id = ? AND owner_type = ? AND owner_id = ?",
+                         (area_id, owner_type, owner_id))
+        return c.rowcount == 1
+
+def get_search_areas():
+    """Get a dict of (owner_type, owner_id) -> [(area_id, (west, south, east, north))]"""
+    conn = get_connection()
+    c = conn.execute("SELECT id, owner_type, owner_id, west, south, east, north FROM search_areas ORDER BY id")
+    areas = {}
+    for area_id, owner_type, owner_id, *rect in c.fetchall():
+        areas.setdefault((owner_type, owner_id), []).append((area_id, tuple(rect)))
+    return areas
+
+def set_crous_filter(owner_type, owner_id, max_rent, min_area, min_bedrooms, equipment):
+    """Save the CROUS filter of a guild or user; equipment is an iterable of normalized labels"""
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO crous_filters (owner_type, owner_id, max_rent, min_area, min_bedrooms, equipment) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     (owner_type, owner_id, max_rent, min_area, min_bedrooms, ",".join(sorted(equipment))))
+
+def clear_crous_filter(owner_type, owner_id):
+    """Remove the CROUS filter of a guild or user"""
+    with transaction() as conn:
+        conn.execute("DELETE FROM crous_filters WHERE owner_type = ? AND owner_id = ?", (owner_type, owner_id))
+
+def get_crous_filters():
+    """Get a dict of (owner_type, owner_id) -> (max_rent, min_area, min_bedrooms, frozenset of equipment)"""
+    conn = get_connection()
+    c = conn.execute("SELECT owner_type, owner_id, max_rent, min_area, min_bedrooms, equipment FROM crous_filters")
+    return {(owner_type, owner_id): (max_rent, min_area, min_bedrooms, frozenset(filter(None, equipment.split(","))))
+            for owner_type, owner_id, max_rent, min_area, min_bedrooms, equipment in c.fetchall()}
+
+def add_watch(owner_type, owner_id, residence_key, residence):
+    """Watch a Studefi residence for a guild or user"""
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO residence_watches (owner_type, owner_id, residence_key, residence) "
+                     "VALUES (?, ?, ?, ?)", (owner_type, owner_id, residence_key, residence))
+
+def remove_watch(owner_type, owner_id, residence_key):
+    """Stop watching a residence; returns False if it wasn't watched"""
+    with transaction() as conn:
+        c = conn.execute("DELETE FROM residence_watches WHERE owner_type = ? AND owner_id = ? AND residence_key = ?",
+                         (owner_type, owner_id, residence_key))
+        return c.rowcount == 1
+
+def get_watches():
+    """Get a dict of (owner_type, owner_id) -> {residence_key: residence}"""
+    conn = get_connection()
+    c = conn.execute("SELECT owner_type, owner_id, residence_key, residence FROM residence_watches ORDER BY rowid")
+    watches = {}
+    for owner_type, owner_id, residence_key, residence in c.fetchall():
+        watches.setdefault((owner_type, owner_id), {})[residence_key] = residence
+    return watches
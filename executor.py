@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+
+MAX_CONCURRENT = 8  # Reservation attempts running at once
+STEP_TIMEOUT = 20  # Seconds allowed for one HTTP step
+ATTEMPT_TIMEOUT = 90  # Seconds allowed for a whole attempt, including waiting for a slot
+HISTORY_SIZE = 100  # Attempt records kept for !reservations
+
+
+class ReservationExecutor:
+    """Runs reservation work under a concurrency cap and deadlines.
+
+    Every task it starts is tracked so shutdown can cancel it, and every
+    attempt leaves a record: stage reached, duration of each HTTP step,
+    outcome and error.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, history=HISTORY_SIZE):
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks = set()
+        self.results = deque(maxlen=history)
+
+    def spawn(self, coro):
+        """Start a background task that shutdown() will cancel"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Reservation task failed: {task.exception()}")
+
+    async def run(self, residence, email, attempt):
+        """Run attempt(record) in a slot and under the overall deadline.
+
+        Returns what the attempt returns, or False if it timed out.
+        """
+        record = {
+            "residence": residence,
+            "email": email,
+            "started": datetime.now(),
+            "stage": "waiting for slot",
+            "steps": {},  # Stage -> milliseconds
+            "outcome": "running",
+            "error": None,
+            "duration": None,
+        }
+        self.results.append(record)
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._run_in_slot(attempt, record), ATTEMPT_TIMEOUT)
+            record["outcome"] = "confirmed" if result else "failed"
+            return result
+        except asyncio.TimeoutError:
+            record["outcome"] = "timed out"
+            record["error"] = record["error"] or f"Deadline reached during {record['stage']}"
+            return False
+        except asyncio.CancelledError:
+            record["outcome"] = "cancelled"
+            raise
+        finally:
+            record["duration"] = (time.monotonic() - start) * 1000
+
+    async def _run_in_slot(self, attempt, record):
+        async with self._slots:
+            record["stage"] = "started"
+            return await attempt(record)
+
+    async def step(self, record, stage, awaitable):
+        """Await one HTTP step under STEP_TIMEOUT and time it in the record"""
+        record["stage"] = stage
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(awaitable, STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            record["error"] = f"{stage} took over {STEP_TIMEOUT}s"
+            raise
+        finally:
+            record["steps"][stage] = (time.monotonic() - start) * 1000
+
+    def running(self):
+        return sum(1 for record in self.results if record["outcome"] == "running")
+
+    async def shutdown(self):
+        """Cancel every task started by the executor and wait for them"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+executor = ReservationExecutor()
@@ -0,0 +1,109 @@
+import bisect
+from queue_index import normalize
+
+# A filter is (max rent in centimes, min area in m², min bedrooms, frozenset of
+# normalized equipment labels); None means "any" for the first three.
+NO_FILTER = (None, None, None, frozenset())
+
+
+def item_features(item):
+    """(lowest rent, largest area, bedrooms, equipment labels) of a CROUS item; None if unknown"""
+    rents = [(mode.get('rent') or {}).get('min') for mode in item.get('occupationModes') or ()]
+    rents = [rent for rent in rents if rent is not None]
+    area = item.get('area') or {}
+    return (
+        min(rents) if rents else None,
+        area.get('max') or area.get('min'),
+        item.get('bedroomCount'),
+        {normalize(eq.get('label', '')) for eq in item.get('equipments') or ()},
+    )
+
+
+def describe(criteria):
+    """Human readable summary of a filter"""
+    max_rent, min_area, min_bedrooms, equipment = criteria
+    parts = []
+    if max_rent is not None:
+        parts.append(f"rent ≤ {max_rent / 100:.0f}€")
+    if min_area is not None:
+        parts.append(f"area ≥ {min_area:g}m²")
+    if min_bedrooms is not None:
+        parts.append(f"bedrooms ≥ {min_bedrooms}")
+    if equipment:
+        parts.append("with " + ", ".join(sorted(equipment)))
+    return ", ".join(parts) or "no filter"
+
+
+class FilterIndex:
+    """Matches CROUS items against every subscriber's filter at once.
+
+    Subscribers sharing a filter share one bit of an integer bitmask. Each
+    criterion is compiled into bitmasks of the filters it lets through:
+    sorted thresholds for rent, area and bedrooms (one bisect per item),
+    and per equipment label the filters requiring it. An item's matching
+    filters are the AND of those masks, whatever the number of subscribers.
+    """
+
+    def __init__(self):
+        self._groups = {}  # Filter bit -> set of subscribers using that filter
+        self._thresholds = []  # Per numeric criterion: (sorted thresholds, cumulative masks, mask of filters without it, is a maximum)
+        self._equipment = {}  # Normalized label -> mask of filters requiring it
+        self._all = 1
+
+    def build(self, subscriptions):
+        """Index a dict of subscriber -> filter; subscribers not listed match everything"""
+        bits = {}
+        for criteria in set(subscriptions.values()) | {NO_FILTER}:
+            bits[criteria] = 1 << len(bits)
+        self._groups = {}
+        for subscriber, criteria in subscriptions.items():
+            self._groups.setdefault(bits[criteria], set()).add(subscriber)
+        self._all = (1 << len(bits)) - 1
+
+        # Rent: filters with max rent >= the item's rent; area and bedrooms:
+        # filters whose minimum is <= the item's value
+        self._thresholds = []
+        for position, is_max in ((0, True), (1, False), (2, False)):
+            limits = sorted((criteria[position], bit) for criteria, bit in bits.items()
+                            if criteria[position] is not None)
+            values = [limit for limit, _ in limits]
+            cumulative = [0]
+            if is_max:
+                for _, bit in reversed(limits):
+                    cumulative.append(cumulative[-1] | bit)
+                cumulative.reverse()  # cumulative[i]: filters at positions >= i
+            else:
+                for _, bit in limits:
+                    cumulative.append(cumulative[-1] | bit)  # cumulative[i]: filters at positions < i
+            unset = self._all & ~(cumulative[0] if is_max else cumulative[-1])
+            self._thresholds.append((values, cumulative, unset, is_max))
+
+        self._equipment = {}
+        for criteria, bit in bits.items():
+            for label in criteria[3]:
+                self._equipment[label] = self._equipment.get(label, 0) | bit
+
+    def matching_mask(self, item):
+        """Bitmask of the filters an item satisfies; unknown item values pass"""
+        features = item_features(item)
+        mask = self._all
+        for value, (values, cumulative, unset, is_max) in zip(features, self._thresholds):
+            if value is None:
+                continue
+            if is_max:
+                mask &= unset | cumulative[bisect.bisect_left(values, value)]
+            else:
+                mask &= unset | cumulative[bisect.bisect_right(values, value)]
+        for label, required_by in self._equipment.items():
+            if label not in features[3]:
+                mask &= ~required_by
+        return mask
+
+    def select(self, mask, subscribers):
+        """Subscribers whose filter is in a matching_mask() result.
+
+        Items with the same mask select the same subscribers, so callers
+        can group items by mask and select once per group.
+        """
+        rejected = [group for bit, group in self._groups.items() if not mask & bit]
+        return set(subscribers).difference(*rejected)
@@ -0,0 +1,41 @@
+from curl_cffi import AsyncCurl, CurlHttpVersion, CurlMOpt, CurlOpt
+from curl_cffi import requests
+
+# Connection tuning for the shared session
+MAX_CLIENTS = 16  # Concurrent transfers across all hosts
+MAX_HOST_CONNECTIONS = 4  # Open connections kept per host
+REQUEST_TIMEOUT = 15  # Seconds
+
+_session = None
+
+
+def get_session():
+    """Return the process-wide AsyncSession, creating it on first use.
+
+    The session keeps TCP/TLS connections alive between polls and negotiates
+    HTTP/2 where the server supports it, so repeated requests to CROUS and
+    Studefi reuse warm connections. Must be called from the running event loop.
+    """
+    global _session
+    if _session is None:
+        acurl = AsyncCurl()
+        acurl.setopt(CurlMOpt.MAX_HOST_CONNECTIONS, MAX_HOST_CONNECTIONS)
+        acurl.setopt(CurlMOpt.MAXCONNECTS, MAX_CLIENTS)
+        _session = requests.AsyncSession(
+            async_curl=acurl,
+            max_clients=MAX_CLIENTS,
+            impersonate="chrome",
+            http_version=CurlHttpVersion.V2TLS,
+            timeout=REQUEST_TIMEOUT,
+            curl_options={CurlOpt.TCP_KEEPALIVE: 1},
+        )
+    return _session
+
+
+async def close_session():
+    """Close the shared session and its connections"""
+    global _session
+    if _session is not None:
+        await _session.close()
+        await _session.acurl.close()  # Created by us, so not closed by the session
+        _session = None
@@ -1,13 +1,28 @@
 import os
 import asyncio
+import difflib
 import json
-from curl_cffi import requests
+import time
 import discord
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-from db_manager import init_db, add_dm_user, remove_dm_user, get_all_dm_users, is_dm_user, add_to_queue, remove_from_queue, get_queue, is_in_queue
-from reservation import process_queue_for_residence
+from async_db import init_db, add_dm_user, remove_dm_user, get_all_dm_users, is_dm_user, get_queue, clear_claims, set_digest_window, add_search_area, replace_search_areas, remove_search_area, get_search_areas, set_crous_filter, clear_crous_filter, get_crous_filters, add_watch, remove_watch, get_watches, get_digest_windows
+from queue_index import index as queue_index, enqueue, dequeue, normalize, FIRST_AVAILABLE
+import async_db
+from reservation import dispatch_reservations, dispatch_stats, prepare_submission, drop_submission
+from executor import executor
+from seen_store import SeenStore
+from http_client import get_session, close_session
+from session_pool import reservation_pool, KEEPALIVE_INTERVAL
+import prefetch
+from studefi_listing import fetch_listing, stats as listing_stats
+from scheduler import crous_schedule, studefi_schedule
+from notifier import fan_out
+import recipients
+from crous_api import API_URL, get_payload, poll_areas, item_digest, stats as crous_stats
+from filters import FilterIndex, NO_FILTER, describe as describe_filter
+from watches import WatchIndex, MAX_WATCHES, WATCH_ALL, watch_key
+from areas import AreaIndex, DEFAULT_AREA, MAX_AREAS, to_rect, to_bounds, item_location, area_error
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -22,78 +37,43 @@ from keep_alive import keep_alive
 keep_alive()
 
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+class CrousBot(commands.Bot):
+    async def close(self):
+        await executor.shutdown()
+        await reservation_pool.close()
+        await close_session()
+        await super().close()
+        await async_db.close()
+
+
+bot = CrousBot(command_prefix='!', intents=intents)
 
 # Global variables for tracking
-last_results = set()
-last_studefi_results = set()
+crous_seen = SeenStore("crous")  # Persisted in seen_items, loaded on startup
+studefi_seen = SeenStore("studefi", gone_after=120)  # A residence reopening is worth a new alert
 channels = []  # List of channels, one per guild
 dm_users = set()  # Will be loaded from database
+digest_windows = {}  # User ID -> digest window in seconds, loaded from database
 
-location_bounds = {
-    "lon1": 1.9954155920674,
-    "lat1": 49.095452162534826,
-    "lon2": 2.7246331213642754,
-    "lat2": 48.33343022631068
-}
+search_areas = {}  # (owner type, owner ID) -> [(area ID, rectangle)], loaded from database
+area_index = AreaIndex()  # Routes CROUS items to the guilds and DM users whose areas contain them
+crous_filters = {}  # (owner type, owner ID) -> filter tuple, see filters.py
+filter_index = FilterIndex()  # Drops CROUS items a subscriber's filter rejects
+equipment_labels = {}  # Normalized label -> CROUS equipment label, from fetched items
+residence_watches = {}  # (owner type, owner ID) -> {watch key: residence as typed}, loaded from database
+watch_index = WatchIndex()  # Routes Studefi residences to the guilds and DM users watching them
 
-API_URL = "https://trouverunlogement.lescrous.fr/api/fr/search/41"
 STUDEFI_URL = "https://www.studefi.fr/main.php"
+ANNOUNCE_RESTARTS = False  # DM every user when the bot comes online
+STUDEFI_CHANNEL_BROADCAST = True  # Servers watching no residence still get every Studefi alert
 
 
-def get_payload():
-    """Generate the API payload with current location bounds"""
-    return {
-        "idTool":
-        41,
-        "need_aggregation":
-        True,
-        "page":
-        1,
-        "pageSize":
-        24,
-        "sector":
-        None,
-        "occupationModes": [],
-        "location": [{
-            "lon": location_bounds["lon1"],
-            "lat": location_bounds["lat1"]
-        }, {
-            "lon": location_bounds["lon2"],
-            "lat": location_bounds["lat2"]
-        }],
-        "residence":
-        None,
-        "precision":
-        4,
-        "equipment": [],
-        "price": {
-            "max": 10000000
-        },
-        "area": {
-            "min": 0
-        },
-        "toolMechanism":
-        "residual"
-    }
-
-
-def get_studefi_residence_names():
+async def get_studefi_residence_names():
     """Fetch all known residence names from Studefi"""
     try:
-        response = requests.get(STUDEFI_URL, impersonate="chrome")
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            elements = soup.find_all("div", class_="col-sm-6 list-res-elem")
-            
-            residences = []
-            for elem in elements:
-                name_tag = elem.find("div", class_="list-res-link")
-                if name_tag and name_tag.find("a"):
-                    name = name_tag.find("a").get_text(strip=True)
-                    if name:
-                        residences.append(name)
-            return residences
+        residences = await fetch_listing()
+        if residences is not None:
+            return [name for name, _, _ in residences if name]
     except Exception as e:
         print(f"Error fetching residences list: {e}")
     return []
@@ -110,10 +90,14 @@ def format_rent(rent_info):
     return "N/A"
 
 
-def create_accommodation_embed(item):
-    """Create a Discord embed for an accommodation"""
-    embed = discord.Embed(title=f"🏠 {item.get('label', 'Unknown')}",
-                          color=0x00ff00)
+def create_accommodation_embed(item, updated=False):
+    """Create a Discord embed for an accommodation, or for one whose details changed"""
+    if updated:
+        embed = discord.Embed(title=f"🔄 Updated: {item.get('label', 'Unknown')}",
+                              color=0xffa500)
+    else:
+        embed = discord.Embed(title=f"🏠 {item.get('label', 'Unknown')}",
+                              color=0x00ff00)
 
     # Basic info
     residence = item.get('residence', {})
@@ -183,140 +167,220 @@ def create_studefi_embed(name, link):
     return embed
 
 
-async def send_to_all_channels(message=None, embed=None):
-    """Send a message or embed to all tracked channels and DM users"""
-    # Send to channels
-    for ch in channels:
-        try:
-            if message:
-                await ch.send(message)
-            if embed:
-                await ch.send(embed=embed)
-        except Exception as e:
-            print(f"Error sending to channel {ch}: {e}")
-    
-    # Send to DM users
+def group_routes(routes, key=tuple):
+    """Turn subscriber -> alerts into (alerts, channels, DM user IDs) groups, one per
+    distinct key(alerts), so subscribers getting the same alerts share one fan-out"""
+    channel_by_guild = {channel.guild.id: channel for channel in channels}
+    groups = {}
+    for (owner_type, owner_id), routed in routes.items():
+        group = groups.setdefault(key(routed), (routed, [], []))
+        if owner_type == "guild" and owner_id in channel_by_guild:
+            group[1].append(channel_by_guild[owner_id])
+        elif owner_type == "user":
+            group[2].append(owner_id)
+    return groups
+
+
+def owner_areas(owner):
+    """Rectangles searched for a guild or DM user; the default area if none are saved"""
+    return [rect for _, rect in search_areas.get(owner, ())] or [DEFAULT_AREA]
+
+
+def rebuild_area_index():
+    """Re-index every subscriber's search areas after channels, DM users or areas change"""
+    subscriptions = {("guild", channel.guild.id): owner_areas(("guild", channel.guild.id)) for channel in channels}
     for user_id in dm_users:
-        try:
-            user = await bot.fetch_user(user_id)  # Use fetch_user instead of get_user
-            if user:
-                if message:
-                    await user.send(message)
-                if embed:
-                    await user.send(embed=embed)
-        except Exception as e:
-            print(f"Error sending DM to user {user_id}: {e}")
+        subscriptions[("user", user_id)] = owner_areas(("user", user_id))
+    area_index.build(subscriptions)
+
+
+async def send_routed_alerts(alerts, sources):
+    """Send each (item, updated) alert only to the subscribers whose areas contain it
+    and whose filter accepts it.
+
+    Subscribers that get the same alerts share one fan-out. sources maps an
+    item ID to the covering area it came from, used for items without
+    coordinates.
+    """
+    # Items in the same areas that pass the same filters go to the same
+    # subscribers, so subscriber sets are only expanded once per such group
+    keyed = {}  # (areas, filter mask) -> [(item, updated)]
+    for item, updated in alerts:
+        location = item_location(item)
+        if location:
+            item_areas = area_index.areas_at(*location)
+        else:
+            item_areas = area_index.areas_within(sources[item.get('id')])
+        keyed.setdefault((item_areas, filter_index.matching_mask(item)), []).append((item, updated))
+
+    routes = {}  # Subscriber -> [(item, updated)]
+    for (item_areas, mask), routed in keyed.items():
+        for subscriber in filter_index.select(mask, area_index.subscribers_of(item_areas)):
+            routes.setdefault(subscriber, []).extend(routed)
+
+    groups = group_routes(routes, key=lambda routed: tuple((item.get('id'), updated) for item, updated in routed))
+
+    sends = []
+    for routed, group_channels, user_ids in groups.values():
+        new_count = sum(1 for _, updated in routed if not updated)
+        header = []
+        if new_count:
+            header.append(f"🚨 **{new_count} new accommodation(s) found!**")
+        if len(routed) > new_count:
+            header.append(f"🔄 **{len(routed) - new_count} accommodation(s) updated**")
+        sends.append(fan_out(bot, group_channels, user_ids, message="\n".join(header),
+                             embeds=[create_accommodation_embed(item, updated=updated) for item, updated in routed],
+                             digest_windows=digest_windows))
+    await asyncio.gather(*sends)
+
+
+async def send_studefi_alerts(new_residences):
+    """Send new (name, link) Studefi residences to the guilds and DM users watching them.
+
+    Users only get watch alerts while their DM notifications are on (!dm).
+    Servers without any watch get every residence if STUDEFI_CHANNEL_BROADCAST.
+    """
+    routes = {}  # Subscriber -> [(name, link)]
+    for name, link in new_residences:
+        for subscriber in watch_index.watchers(name):
+            if subscriber[0] == "user" and subscriber[1] not in dm_users:
+                continue
+            routes.setdefault(subscriber, []).append((name, link))
+    if STUDEFI_CHANNEL_BROADCAST:
+        for channel in channels:
+            owner = ("guild", channel.guild.id)
+            if owner not in residence_watches:
+                routes[owner] = list(new_residences)
+
+    await asyncio.gather(*(
+        fan_out(bot, group_channels, user_ids,
+                message=f"🏢 **{len(routed)} new Studefi residence(s) available!**",
+                embeds=[create_studefi_embed(name, link) for name, link in routed],
+                digest_windows=digest_windows)
+        for routed, group_channels, user_ids in group_routes(routes).values()))
 
 
 async def check_crous_api():
     """Check the CROUS API for new accommodations"""
-    global last_results
 
     if not channels:
         return
 
     try:
-        response = requests.post(API_URL, json=get_payload())
-        print(f"Response API code : {response.status_code}")
-        if response.status_code == 200:
-            data = response.json()
-            results = data.get('results', {})
-            items = results.get('items', [])
-            if items:
-                print(items)
-            # Create set of current item IDs
-            current_results = {item.get('id') for item in items}
-
-            # Find new items
-            new_items = [item for item in items if item.get('id') not in last_results]
-
-            # Update last results
-            last_results = current_results
-
-            # Send alerts for new items
-            if new_items:
-                await send_to_all_channels(
-                    f"🚨 **{len(new_items)} new accommodation(s) found!**")
-
-                for item in new_items:
-                    embed = create_accommodation_embed(item)
-                    await send_to_all_channels(embed=embed)
+        # One query per covering area, however many subscribers share it
+        covering = area_index.covering
+        polled = await poll_areas([to_bounds(rect) for rect in covering])
+        if any(result is not None and result[3] for result in polled):
+            items_by_id = {}
+            sources = {}  # Item ID -> covering area it was fetched from
+            total = 0
+            for rect, result in zip(covering, polled):
+                if result is None:
+                    continue
+                total += result[1]
+                for item in result[0]:
+                    items_by_id.setdefault(item.get('id'), item)
+                    sources.setdefault(item.get('id'), rect)
+            items = list(items_by_id.values())
+            for item in items:
+                for eq in item.get('equipments') or ():
+                    equipment_labels.setdefault(normalize(eq.get('label', '')), eq.get('label', ''))
+            complete = all(result is not None and result[2] for result in polled)
+            # Classify items as new, changed or unchanged; IDs missing from a
+            # few polls (or from pages that failed) are remembered so they
+            # aren't reported again
+            new_ids, changed_ids = crous_seen.update(
+                {item.get('id'): item_digest(item) for item in items}, complete)
+            new_ids, changed_ids = set(new_ids), set(changed_ids)
+            new_items = [item for item in items if item.get('id') in new_ids]
+            changed_items = [item for item in items if item.get('id') in changed_ids]
+
+            # Send alerts for new and updated items, routed by search area
+            if new_items or changed_items:
+                await send_routed_alerts(
+                    [(item, False) for item in new_items] + [(item, True) for item in changed_items], sources)
 
             print(
-                f"API check completed. Found {len(items)} total items, {len(new_items)} new."
+                f"API check completed. Found {len(items)}/{total} total items, "
+                f"{len(new_items)} new, {len(changed_items)} updated."
             )
-        else:
-            print(f"API request failed with status: {response.status_code}")
+            await crous_seen.save()
 
     except Exception as e:
+        crous_schedule.record_error()
         print(f"Error checking API: {e}")
 
 
 async def check_studefi():
     """Check Studefi website for available residences"""
-    global last_studefi_results
 
     if not channels:
         return
 
     try:
-        response = requests.get(STUDEFI_URL, impersonate="chrome")
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            elements = soup.find_all("div", class_="col-sm-6 list-res-elem")
-            
-            current_results = set()
-            new_residences = []
-
-            for elem in elements:
-                img_tag = elem.find("img", class_="dispoRes")
-                if img_tag:
-                    img_src = img_tag.get("src", "")
-                    if "non_disponibles" not in img_src:
-                        name_tag = elem.find("div", class_="list-res-link").find("a")
-                        name = name_tag.get_text(strip=True)
-                        link = name_tag.get("href", "")
-                        result_id = f"{name}:{link}"
-                        current_results.add(result_id)
-                        
-                        if result_id not in last_studefi_results:
-                            new_residences.append((name, link))
-
-            last_studefi_results = current_results
+        residences = await fetch_listing()
+        if residences is not None:
+            available_residences = {}
+            all_residences = []
+
+            for name, link, available in residences:
+                all_residences.append((name, link))
+                if available:
+                    available_residences[f"{name}:{link}"] = (name, link)
+
+            new_ids, _ = studefi_seen.update(list(available_residences))
+            new_residences = [available_residences[result_id] for result_id in new_ids]
+
+            detected_at = time.monotonic()
+            prefetch.update_known_residences(all_residences)
+            queue_index.update_residences(name for name, _ in all_residences)
 
             if new_residences:
-                await send_to_all_channels(
-                    f"🏢 **{len(new_residences)} new Studefi residence(s) available!**")
-                
-                # Process queue for new residences
-                queue = get_queue()
-                if queue:
-                    for name, link in new_residences:
-                        # Ensure not to block the main loop by running in background
-                        asyncio.create_task(process_queue_for_residence(name, link, queue, bot))
-
-                for name, link in new_residences:
-                    embed = create_studefi_embed(name, link)
-                    await send_to_all_channels(embed=embed)
+                # Process queue for new residences before announcing them,
+                # so reservations don't wait behind Discord sends
+                if len(queue_index):
+                    # Ensure not to block the main loop by running in background
+                    executor.spawn(dispatch_reservations(new_residences, bot, detected_at))
+
+                await send_studefi_alerts(new_residences)
+            await studefi_seen.save()
 
     except Exception as e:
+        studefi_schedule.record_error()
         print(f"Error checking Studefi: {e}")
 
 
-@tasks.loop(seconds=3)
+@tasks.loop(seconds=crous_schedule.interval)
 async def api_monitor():
-    """Task that runs every 5 seconds to check the API"""
+    """Task that checks the API at the cadence chosen by its scheduler"""
     await check_crous_api()
+    api_monitor.change_interval(seconds=crous_schedule.next_delay())
 
 
-@tasks.loop(seconds=3)
+@tasks.loop(seconds=studefi_schedule.interval)
 async def studefi_monitor():
-    """Task that runs every 5 seconds to check Studefi"""
+    """Task that checks Studefi at the cadence chosen by its scheduler"""
     await check_studefi()
+    studefi_monitor.change_interval(seconds=studefi_schedule.next_delay())
+
+
+@tasks.loop(seconds=KEEPALIVE_INTERVAL)
+async def session_pool_keeper():
+    """Task that keeps the reservation session pool warm"""
+    await reservation_pool.keep_warm()
+
+
+@tasks.loop(seconds=prefetch.PREFETCH_INTERVAL)
+async def prefetch_monitor():
+    """Task that resolves queued users' residences ahead of availability"""
+    if len(queue_index):
+        await prefetch.refresh(queue_index.targeted_residences())
 
 
 @api_monitor.before_loop
 @studefi_monitor.before_loop
+@session_pool_keeper.before_loop
+@prefetch_monitor.before_loop
 async def before_api_monitor():
     """Wait until the bot is ready before starting the monitoring"""
     await bot.wait_until_ready()
@@ -324,22 +388,31 @@ async def before_api_monitor():
 
 @bot.event
 async def on_ready():
-    global channels, dm_users
+    global channels, dm_users, digest_windows
     print(f'Bot logged in as {bot.user}')
     
     # Initialize database and load DM users
-    init_db()
-    dm_users = get_all_dm_users()
-    print(f"Loaded {len(dm_users)} DM users from database")
-
-    # Notify all users with DM notifications enabled
-    for user_id in dm_users:
-        try:
-            user = await bot.fetch_user(user_id)
-            if user:
-                await user.send("📢 **CROUS Alert Bot is now online!**\nYou will continue to receive notifications.")
-        except Exception as e:
-            print(f"Error sending startup DM to user {user_id}: {e}")
+    await init_db()
+    dm_users = await get_all_dm_users()
+    digest_windows = await get_digest_windows()
+    await recipients.load()
+    queue = await get_queue()
+    queue_index.load(queue)
+    for user_id, _, email, _, _ in queue:
+        prepare_submission(user_id, email)
+    await clear_claims()  # Reservations interrupted by a restart won't finish
+    print(f"Loaded {len(dm_users)} DM users and {len(queue_index)} queued users from database")
+
+    # Restore what was already announced; a source without saved state
+    # gets a silent first poll so a fresh install doesn't flood everyone
+    await crous_seen.load()
+    await studefi_seen.load()
+    print(f"Loaded {len(crous_seen)} CROUS and {len(studefi_seen)} Studefi seen items")
+
+    if ANNOUNCE_RESTARTS:
+        # Notify all users with DM notifications enabled
+        await fan_out(bot, [], list(dm_users),
+                      message="📢 **CROUS Alert Bot is now online!**\nYou will continue to receive notifications.")
 
     channels = []
     # Find or create CrousAlert channel
@@ -352,12 +425,30 @@ async def on_ready():
             try:
                 channel = await guild.create_text_channel('crousalert')
                 await channel.send(
-                    "🏠 **CROUS Alert Bot Started!**\nMonitoring for new accommodations every 5 seconds."
+                    "🏠 **CROUS Alert Bot Started!**\nMonitoring for new accommodations every few seconds."
                 )
                 channels.append(channel)
             except discord.Forbidden:
                 print(f"No permission to create channel in {guild.name}")
 
+    search_areas.clear()
+    for owner, saved in (await get_search_areas()).items():
+        # Areas saved before coordinates were validated must not stop the bot from starting
+        valid = [(area_id, rect) for area_id, rect in saved if not area_error(rect)]
+        if len(valid) < len(saved):
+            print(f"Ignoring {len(saved) - len(valid)} invalid search area(s) of {owner}")
+        if valid:
+            search_areas[owner] = valid
+    rebuild_area_index()
+    crous_filters.clear()
+    crous_filters.update(await get_crous_filters())
+    filter_index.build(crous_filters)
+    residence_watches.clear()
+    residence_watches.update(await get_watches())
+    watch_index.build(residence_watches)
+    print(f"Indexed {area_index.area_count()} search area(s), {len(area_index.covering)} queried per cycle, "
+          f"{len(watch_index)} watched residence name(s)")
+
     if channels:
         print(f"Using channels: {[ch.name for ch in channels]}")
         # Start both monitoring tasks
@@ -365,31 +456,235 @@ async def on_ready():
             api_monitor.start()
         if not studefi_monitor.is_running():
             studefi_monitor.start()
+        if not session_pool_keeper.is_running():
+            session_pool_keeper.start()
+        if not prefetch_monitor.is_running():
+            prefetch_monitor.start()
     else:
         print("No suitable channel found or created")
 
 
+async def settings_owner(ctx, what):
+    """Settings changed in a server belong to the server (Manage Server needed), those changed in DMs to the user"""
+    if ctx.guild is None:
+        return ("user", ctx.author.id)
+    if not ctx.author.guild_permissions.manage_guild:
+        await ctx.send(f"❌ You need the Manage Server permission to change this server's {what}. "
+                       "Send the command to me in DMs to set your own.")
+        return None
+    return ("guild", ctx.guild.id)
+
+
+async def save_area(ctx, rect, replace):
+    owner = await settings_owner(ctx, "search areas")
+    if owner is None:
+        return
+    error = area_error(rect)
+    if error:
+        await ctx.send(f"❌ {error}")
+        return
+    if not replace and len(search_areas.get(owner, ())) >= MAX_AREAS:
+        await ctx.send(f"❌ At most {MAX_AREAS} search areas. Remove one with `!removelocation <id>` first.")
+        return
+
+    if replace:
+        area_id = await replace_search_areas(*owner, rect)
+        search_areas[owner] = [(area_id, rect)]
+    else:
+        area_id = await add_search_area(*owner, rect)
+        search_areas.setdefault(owner, []).append((area_id, rect))
+    rebuild_area_index()
+
+    west, south, east, north = rect
+    embed = discord.Embed(
+        title="📍 Location Updated" if replace else "📍 Location Added",
+        description=f"Search area #{area_id} saved for {'this server' if owner[0] == 'guild' else 'your DMs'}:",
+        color=0x0099ff)
+    embed.add_field(name="Coordinates",
+                    value=f"North-west: {west}, {north}\nSouth-east: {east}, {south}",
+                    inline=False)
+    await ctx.send(embed=embed)
+    print(f"Search area {area_id} saved for {owner}: {rect}")
+
+
 @bot.command(name='setlocation')
 async def set_location(ctx, lon1: float, lat1: float, lon2: float,
                        lat2: float):
-    """Set custom location boundaries for the search
+    """Replace the search areas of this server (or yours, in DMs) with one area
     Usage: !setlocation <lon1> <lat1> <lon2> <lat2>
     Example: !setlocation 1.99 49.09 2.72 48.33
     """
-    global location_bounds
+    await save_area(ctx, to_rect(lon1, lat1, lon2, lat2), replace=True)
 
-    location_bounds = {"lon1": lon1, "lat1": lat1, "lon2": lon2, "lat2": lat2}
 
-    embed = discord.Embed(
-        title="📍 Location Updated",
-        description="Search area has been updated with new coordinates:",
-        color=0x0099ff)
-    embed.add_field(name="Coordinates",
-                    value=f"Point 1: {lon1}, {lat1}\nPoint 2: {lon2}, {lat2}",
-                    inline=False)
+@bot.command(name='addlocation')
+async def add_location(ctx, lon1: float, lat1: float, lon2: float,
+                       lat2: float):
+    """Add another search area for this server (or for you, in DMs)
+    Usage: !addlocation <lon1> <lat1> <lon2> <lat2>
+    """
+    await save_area(ctx, to_rect(lon1, lat1, lon2, lat2), replace=False)
+
+
+@bot.command(name='locations')
+async def list_locations(ctx):
+    """List the search areas of this server (or yours, in DMs)"""
+    owner = ("guild", ctx.guild.id) if ctx.guild else ("user", ctx.author.id)
+    saved = search_areas.get(owner, [])
+    embed = discord.Embed(title="📍 Search Areas", color=0x0099ff)
+    if not saved:
+        west, south, east, north = DEFAULT_AREA
+        embed.description = f"No saved area, using the default one:\nNorth-west: {west}, {north}\nSouth-east: {east}, {south}"
+    for area_id, (west, south, east, north) in saved:
+        embed.add_field(name=f"#{area_id}",
+                        value=f"North-west: {west}, {north}\nSouth-east: {east}, {south}",
+                        inline=False)
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='removelocation')
+async def remove_location(ctx, area_id: int):
+    """Remove a search area by its ID (see !locations)
+    Usage: !removelocation <id>
+    """
+    owner = await settings_owner(ctx, "search areas")
+    if owner is None:
+        return
+    if not await remove_search_area(*owner, area_id):
+        await ctx.send("❌ No search area with this ID. Use `!locations` to see them.")
+        return
+    search_areas[owner] = [(saved_id, rect) for saved_id, rect in search_areas.get(owner, []) if saved_id != area_id]
+    if not search_areas[owner]:
+        del search_areas[owner]
+    rebuild_area_index()
+    await ctx.send(f"🗑️ Search area #{area_id} removed.")
+
+
+@bot.command(name='filter')
+async def set_filter(ctx, criterion: str = None, *, value: str = None):
+    """Only get CROUS alerts matching a filter (for this server, or for you in DMs)
+    Usage: !filter [rent <max €> | area <min m²> | bedrooms <min> | equipment <label, ...> | clear]
+    Example: !filter rent 450
+    Use "off" as the value to drop one criterion.
+    """
+    if criterion is None:
+        owner = ("guild", ctx.guild.id) if ctx.guild else ("user", ctx.author.id)
+        await ctx.send(f"🔎 Current filter: {describe_filter(crous_filters.get(owner, NO_FILTER))}")
+        return
 
+    owner = await settings_owner(ctx, "filter")
+    if owner is None:
+        return
+    max_rent, min_area, min_bedrooms, equipment = crous_filters.get(owner, NO_FILTER)
+    criterion = criterion.lower()
+    off = value is None or value.strip().lower() == "off"
+    try:
+        if criterion == "clear":
+            max_rent, min_area, min_bedrooms, equipment = NO_FILTER
+        elif criterion == "rent":
+            max_rent = None if off else round(float(value.replace("€", "").replace(",", ".")) * 100)
+        elif criterion == "area":
+            min_area = None if off else float(value.lower().replace("m²", "").replace("m2", "").replace(",", "."))
+        elif criterion == "bedrooms":
+            min_bedrooms = None if off else int(value)
+        elif criterion == "equipment":
+            equipment = frozenset() if off else frozenset(
+                normalize(label) for label in value.split(",") if label.strip())
+        else:
+            await ctx.send("❌ Unknown criterion. Use rent, area, bedrooms, equipment or clear.")
+            return
+    except ValueError:
+        await ctx.send("❌ Invalid value. Example: `!filter rent 450`")
+        return
+
+    # Labels must match CROUS ones, a typo would silently drop every listing
+    unknown = sorted(label for label in equipment if label not in equipment_labels)
+    if unknown and equipment_labels and criterion == "equipment":
+        hints = []
+        for label in unknown:
+            close = difflib.get_close_matches(label, equipment_labels, n=1, cutoff=0.5)
+            hints.append(f"`{label}`" + (f" (did you mean `{equipment_labels[close[0]]}`?)" if close else ""))
+        await ctx.send(f"❌ Unknown equipment: {', '.join(hints)}\n"
+                       f"Known labels: {', '.join(sorted(equipment_labels.values()))}"[:2000])
+        return
+
+    criteria = (max_rent, min_area, min_bedrooms, equipment)
+    if criteria == NO_FILTER:
+        crous_filters.pop(owner, None)
+        await clear_crous_filter(*owner)
+    else:
+        crous_filters[owner] = criteria
+        await set_crous_filter(*owner, max_rent, min_area, min_bedrooms, equipment)
+    filter_index.build(crous_filters)
+    message = f"🔎 Filter for {'this server' if owner[0] == 'guild' else 'your DMs'}: {describe_filter(criteria)}"
+    if unknown and not equipment_labels and criterion == "equipment":
+        message += f"\n⚠️ No listing fetched yet to check {', '.join(unknown)} against, make sure they match CROUS labels."
+    await ctx.send(message)
+
+
+@bot.command(name='watch')
+async def watch(ctx, *, residence: str):
+    """Get Studefi alerts for a residence (for this server, or for you in DMs)
+    Usage: !watch <residence...> or !watch all
+    Example: !watch Massy - Eric Tabarly
+    """
+    owner = await settings_owner(ctx, "watched residences")
+    if owner is None:
+        return
+    key = watch_key(residence)
+    watched = residence_watches.get(owner, {})
+    if key not in watched and len(watched) >= MAX_WATCHES:
+        await ctx.send(f"❌ At most {MAX_WATCHES} watched residences. Remove one with `!unwatch <residence>` first.")
+        return
+    if key != WATCH_ALL:
+        valid_residences = await get_studefi_residence_names()
+        if valid_residences and not any(key in normalize(valid_res) for valid_res in valid_residences):
+            await ctx.send("❌ Valid residence name not found. Use `!residences` to see correct names.")
+            return
+
+    await add_watch(*owner, key, residence)
+    residence_watches.setdefault(owner, {})[key] = residence
+    watch_index.build(residence_watches)
+    target = "every Studefi residence" if key == WATCH_ALL else f"**{residence}**"
+    message = f"👀 {'This server' if owner[0] == 'guild' else 'You'} will be alerted when {target} is available."
+    if owner[0] == "user" and owner[1] not in dm_users:
+        message += "\n⚠️ Your DM notifications are off, turn them on with `!dm` to receive these alerts."
+    await ctx.send(message)
+
+
+@bot.command(name='unwatch')
+async def unwatch(ctx, *, residence: str):
+    """Stop getting Studefi alerts for a residence
+    Usage: !unwatch <residence...>
+    """
+    owner = await settings_owner(ctx, "watched residences")
+    if owner is None:
+        return
+    key = watch_key(residence)
+    if not await remove_watch(*owner, key):
+        await ctx.send("❌ This residence isn't watched. Use `!watches` to see them.")
+        return
+    residence_watches[owner].pop(key, None)
+    if not residence_watches[owner]:
+        del residence_watches[owner]
+    watch_index.build(residence_watches)
+    await ctx.send(f"🗑️ Stopped watching {residence}.")
+
+
+@bot.command(name='watches')
+async def list_watches(ctx):
+    """List the Studefi residences watched by this server (or by you, in DMs)"""
+    owner = ("guild", ctx.guild.id) if ctx.guild else ("user", ctx.author.id)
+    watched = residence_watches.get(owner, {})
+    embed = discord.Embed(title="👀 Watched Studefi Residences", color=0x0099ff)
+    if watched:
+        embed.description = "\n".join("• All residences" if key == WATCH_ALL else f"• {residence}"
+                                       for key, residence in watched.items())
+    elif owner[0] == "guild" and STUDEFI_CHANNEL_BROADCAST:
+        embed.description = "No watched residence, this server gets every Studefi alert."
+    else:
+        embed.description = "No watched residence. Use `!watch <residence>` to get Studefi alerts."
     await ctx.send(embed=embed)
-    print(f"Location bounds updated: {location_bounds}")
 
 
 @bot.command(name='status')
@@ -398,10 +693,13 @@ async def status(ctx):
     embed = discord.Embed(title="🤖 Bot Status", color=0x0099ff)
 
     # Search Area Info
+    owner = ("guild", ctx.guild.id) if ctx.guild else ("user", ctx.author.id)
     embed.add_field(
-        name="📍 Current Search Area",
-        value=f"Point 1: {location_bounds['lon1']}, {location_bounds['lat1']}\n"
-        f"Point 2: {location_bounds['lon2']}, {location_bounds['lat2']}",
+        name="📍 Search Areas",
+        value=f"{len(owner_areas(owner))} area(s) here, see `!locations`\n"
+              f"Filter: {describe_filter(crous_filters.get(owner, NO_FILTER))}\n"
+              f"{area_index.area_count()} distinct area(s) across all subscribers, "
+              f"{len(area_index.covering)} queried per cycle",
         inline=False)
 
     # Monitoring Status
@@ -410,16 +708,20 @@ async def status(ctx):
     
     embed.add_field(
         name="🔄 Monitoring Status",
-        value=f"**CROUS:** {crous_status}\n**Studefi:** {studefi_status}\n"
-              f"*Checking every 5 seconds*",
+        value=f"**CROUS:** {crous_status} every {crous_schedule.describe()}\n"
+              f"**Studefi:** {studefi_status} every {studefi_schedule.describe()}",
         inline=False
     )
 
     # Statistics
     embed.add_field(
         name="📊 Currently Tracking",
-        value=f"**CROUS:** {len(last_results)} accommodations\n"
-              f"**Studefi:** {len(last_studefi_results)} residences",
+        value=f"**CROUS:** {crous_seen.present()} accommodations ({len(crous_seen)} remembered)\n"
+              f"**Studefi:** {studefi_seen.present()} residences, {len(watch_index)} watched name(s)\n"
+              f"*CROUS full fetches on {crous_stats['full_fetches']}/{crous_stats['probes']} polls*\n"
+              f"*Studefi page unchanged on {listing_stats['not_modified'] + listing_stats['hash_hits']}"
+              f"/{listing_stats['polls']} polls, "
+              f"{listing_stats['parse_time_saved'] * 1000:.0f} ms of parsing saved*",
         inline=False
     )
 
@@ -435,16 +737,23 @@ async def status(ctx):
     embed.add_field(
         name="📱 DM Notifications",
         value=f"Active for {len(dm_users)} users\n"
+              f"DM channel cache hit rate: {recipients.hit_rate():.0%}\n"
               f"Your status: {'✅ Enabled' if ctx.author.id in dm_users else '❌ Disabled'}",
         inline=False
     )
     
     # Queue Status
-    queue = get_queue()
+    pool_stats = reservation_pool.stats()
     embed.add_field(
         name="📥 Reservation Queue",
-        value=f"{len(queue)} user(s) in queue\n"
-              f"Your status: {'✅ In Queue' if is_in_queue(ctx.author.id) else '❌ Not in Queue'}",
+        value=f"{len(queue_index)} user(s) in queue\n"
+              f"Your status: {'✅ In Queue' if ctx.author.id in queue_index else '❌ Not in Queue'}\n"
+              f"Reservations: {dispatch_stats['attempted']} attempted over {dispatch_stats['events']} event(s), "
+              f"{dispatch_stats['succeeded']} succeeded (last event: {dispatch_stats['last_event'][1]} "
+              f"for {dispatch_stats['last_event'][0]} residence(s)), "
+              f"{executor.running()} running\n"
+              f"Warm sessions: {pool_stats['idle']} ready, "
+              f"{pool_stats['warm_rate']:.0%} of reservations started warm",
         inline=False
     )
 
@@ -457,7 +766,8 @@ async def test(ctx):
     await ctx.send("🔍 Testing API connection...")
 
     try:
-        response = requests.post(API_URL, json=get_payload())
+        owner = ("guild", ctx.guild.id) if ctx.guild else ("user", ctx.author.id)
+        response = await get_session().post(API_URL, json=get_payload(to_bounds(owner_areas(owner)[0])))
 
         if response.status_code == 200:
             data = response.json()
@@ -496,7 +806,9 @@ async def toggle_dm(ctx):
     
     if user_id in dm_users:
         dm_users.remove(user_id)
-        remove_dm_user(user_id)
+        digest_windows.pop(user_id, None)
+        await remove_dm_user(user_id)
+        rebuild_area_index()
         embed = discord.Embed(
             title="📳 DM Notifications Disabled",
             description="You will no longer receive notifications in DM",
@@ -504,7 +816,8 @@ async def toggle_dm(ctx):
         )
     else:
         dm_users.add(user_id)
-        add_dm_user(user_id)
+        await add_dm_user(user_id)
+        rebuild_area_index()
         embed = discord.Embed(
             title="📳 DM Notifications Enabled",
             description="You will now receive notifications in DM",
@@ -514,6 +827,37 @@ async def toggle_dm(ctx):
     await ctx.send(embed=embed)
 
 
+@bot.command(name='digest')
+async def toggle_digest(ctx, minutes: int = 0):
+    """Merge DM alerts over a window into one message.
+    Usage: !digest <minutes> (0 to receive alerts immediately)
+    Example: !digest 5
+    """
+    user_id = ctx.author.id
+    if user_id not in dm_users:
+        await ctx.send("❌ Enable DM notifications with `!dm` first.")
+        return
+
+    window = max(minutes, 0) * 60
+    await set_digest_window(user_id, window)
+    if window:
+        digest_windows[user_id] = window
+        embed = discord.Embed(
+            title="📬 Digest Mode Enabled",
+            description=f"Alerts will be merged into one DM every {minutes} minute(s)",
+            color=0x00ff00
+        )
+    else:
+        digest_windows.pop(user_id, None)
+        embed = discord.Embed(
+            title="📬 Digest Mode Disabled",
+            description="You will receive alerts as soon as they are found",
+            color=0xff0000
+        )
+
+    await ctx.send(embed=embed)
+
+
 @bot.command(name='queue')
 async def join_queue(ctx, email: str, *, residence: str = "First Available"):
     """Join the Studefi reservation queue.
@@ -521,23 +865,24 @@ async def join_queue(ctx, email: str, *, residence: str = "First Available"):
     Example: !queue example@email.com Massy - Eric Tabarly
     """
     user_id = ctx.author.id
-    if is_in_queue(user_id):
+    if user_id in queue_index:
         await ctx.send("❌ You are already in the queue! Use !unqueue first if you want to change your settings.")
         return
         
-    if residence.lower() != "first available":
-        valid_residences = get_studefi_residence_names()
+    if normalize(residence) != FIRST_AVAILABLE:
+        valid_residences = await get_studefi_residence_names()
         if valid_residences:
             matched = False
             for valid_res in valid_residences:
-                if residence.lower() in valid_res.lower():
+                if normalize(residence) in normalize(valid_res):
                     matched = True
                     break
             if not matched:
                 await ctx.send(f"❌ Valid residence name not found. Use `!residences` to see correct names.")
                 return
 
-    add_to_queue(user_id, residence, email)
+    await enqueue(user_id, residence, email)
+    prepare_submission(user_id, email)
     embed = discord.Embed(
         title="📥 Joined Reservation Queue",
         description=f"You have been added to the Studefi reservation queue.",
@@ -552,11 +897,12 @@ async def join_queue(ctx, email: str, *, residence: str = "First Available"):
 async def leave_queue(ctx):
     """Leave the Studefi reservation queue."""
     user_id = ctx.author.id
-    if not is_in_queue(user_id):
+    if user_id not in queue_index:
         await ctx.send("❌ You are not in the queue.")
         return
         
-    remove_from_queue(user_id)
+    await dequeue(user_id)
+    drop_submission(user_id)
     embed = discord.Embed(
         title="📤 Left Reservation Queue",
         description="You have been removed from the Studefi reservation queue.",
@@ -576,32 +922,72 @@ async def help_crous(ctx):
     embed.add_field(
         name="Commands",
         value=
-        "**!setlocation** `<lon1> <lat1> <lon2> <lat2>` - Set search area\n"
+        "**!setlocation** `<lon1> <lat1> <lon2> <lat2>` - Set search area (server, or yours in DMs)\n"
+        "**!addlocation** `<lon1> <lat1> <lon2> <lat2>` - Add another search area\n"
+        "**!locations** - List search areas\n"
+        "**!filter** `[rent|area|bedrooms|equipment|clear] [value]` - Filter CROUS alerts\n"
+        "**!removelocation** `<id>` - Remove a search area\n"
         "**!status** - Show bot status\n"
         "**!test** - Test API connection\n"
         "**!dm** - Toggle DM notifications\n"
+        "**!digest** `<minutes>` - Merge DM alerts into one message (0 to disable)\n"
+        "**!watch** `<residence...>|all` - Get Studefi alerts for a residence\n"
+        "**!unwatch** `<residence...>` - Stop watching a residence\n"
+        "**!watches** - List watched residences\n"
         "**!queue** `<email> [residence...]` - Join reservation queue\n"
         "**!unqueue** - Leave reservation queue\n"
         "**!residences** - List all valid Studefi residences\n"
+        "**!reservations** `[count]` - Show recent reservation attempts (bot owner)\n"
         "**!help_crous** - Show this help",
         inline=False)
 
     embed.add_field(name="How it works",
-                    value="• Bot checks API every 5 seconds\n"
+                    value="• Bot checks API every few seconds, faster when listings usually appear\n"
                     "• Alerts when new accommodations appear\n"
+                    "• Studefi alerts go to those watching the residence\n"
                     "• Auto-reserves Studefi places if you are in the queue\n"
-                    "• Location boundaries are customizable\n"
+                    "• Each server and DM user can save their own search areas\n"
                     "• Shows detailed accommodation info",
                     inline=False)
 
     await ctx.send(embed=embed)
 
 
+@bot.command(name='reservations')
+@commands.is_owner()  # Records hold the emails of users from every server
+async def reservations(ctx, count: int = 10):
+    """Show the latest reservation attempts and how far they got.
+    Usage: !reservations [count]
+    """
+    records = list(executor.results)[-max(1, min(count, 15)):]
+    if not records:
+        await ctx.send("No reservation attempts yet.")
+        return
+
+    embed = discord.Embed(
+        title="🧾 Recent Reservation Attempts",
+        description=f"{executor.running()} running, at most {executor.max_concurrent} at once",
+        color=0x0099ff)
+    icons = {"confirmed": "✅", "failed": "❌", "timed out": "⏱️", "cancelled": "🚫", "running": "⏳"}
+    for record in reversed(records):
+        steps = ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in record["steps"].items()) or "no HTTP step"
+        duration = f"{record['duration']:.0f} ms" if record["duration"] is not None else "running"
+        value = (f"{record['email']} - {record['outcome']} at {record['stage']} ({duration})\n"
+                 f"Steps: {steps}")
+        if record["error"]:
+            value += f"\nError: {record['error']}"
+        embed.add_field(
+            name=f"{icons.get(record['outcome'], '')} {record['residence']} - {record['started'].strftime('%H:%M:%S')}",
+            value=value[:1024],
+            inline=False)
+    await ctx.send(embed=embed)
+
+
 @bot.command(name='residences')
 async def list_residences(ctx):
     """List all available Studefi residences"""
     await ctx.send("🔍 Fetching Studefi residences...")
-    valid_residences = get_studefi_residence_names()
+    valid_residences = await get_studefi_residence_names()
     if valid_residences:
         valid_residences.sort()
         res_text = "\\n".join(f"• {r}" for r in valid_residences)
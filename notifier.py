@@ -0,0 +1,154 @@
+import asyncio
+import time
+import discord
+from recipients import get_dm_channel, forget
+
+MAX_CONCURRENT_SENDS = 10  # Discord requests in flight at once
+ROUTE_RATE = 5  # Messages per route ...
+ROUTE_PERIOD = 5.0  # ... per this many seconds (Discord's per-channel limit)
+GLOBAL_RATE = 45  # Requests per second across all routes (Discord allows 50)
+MAX_EMBEDS = 10  # Embeds per Discord message
+MAX_EMBED_CHARS = 6000  # Total embed characters per Discord message
+
+_send_slots = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+
+_digests = {}  # User ID -> pending digest {"messages", "embeds", "task"}
+
+last_fanout = {}  # Delivery timings of the most recent fan-out
+
+
+class RouteLimiter:
+    """Token buckets per Discord route plus one global bucket.
+
+    Sends wait for a token here instead of running into 429s and letting
+    discord.py sleep them one by one.
+    """
+
+    def __init__(self, rate, period, global_rate):
+        self.rate = rate
+        self.period = period
+        self.global_rate = global_rate
+        self._routes = {}  # Route -> (tokens, last refill)
+        self._global = (global_rate, time.monotonic())
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _refill(bucket, rate, period, now):
+        tokens, last = bucket
+        return min(rate, tokens + (now - last) * rate / period), now
+
+    async def acquire(self, route):
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                tokens, _ = self._routes[route] = self._refill(
+                    self._routes.get(route, (self.rate, now)), self.rate, self.period, now)
+                global_tokens, _ = self._global = self._refill(
+                    self._global, self.global_rate, 1.0, now)
+                if tokens >= 1 and global_tokens >= 1:
+                    self._routes[route] = (tokens - 1, now)
+                    self._global = (global_tokens - 1, now)
+                    return
+                wait = max((1 - tokens) * self.period / self.rate,
+                           (1 - global_tokens) / self.global_rate)
+            await asyncio.sleep(wait)
+
+
+limiter = RouteLimiter(ROUTE_RATE, ROUTE_PERIOD, GLOBAL_RATE)
+
+
+def batch_embeds(embeds):
+    """Split embeds into groups that fit in one Discord message"""
+    batches = []
+    current, size = [], 0
+    for embed in embeds:
+        if current and (len(current) == MAX_EMBEDS or size + len(embed) > MAX_EMBED_CHARS):
+            batches.append(current)
+            current, size = [], 0
+        current.append(embed)
+        size += len(embed)
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _send(target, route, message=None, embeds=()):
+    """Send a message with its embeds packed into as few messages as possible"""
+    batches = batch_embeds(embeds) or [[]]
+    for i, batch in enumerate(batches):
+        content = message if i == 0 else None
+        if not content and not batch:
+            continue
+        await limiter.acquire(route)
+        await target.send(content=content, embeds=batch)
+
+
+async def _flush_digest(bot, user_id, window):
+    await asyncio.sleep(window)
+    digest = _digests.pop(user_id)
+    messages = digest["messages"]
+    content = "📬 **Alert digest**\n" + "\n".join(messages) if messages else None
+    if content and len(content) > 2000:
+        content = content[:1997] + "..."
+    try:
+        async with _send_slots:
+            target = await get_dm_channel(bot, user_id)
+            await _send(target, f"dm:{user_id}", content, digest["embeds"])
+    except Exception as e:
+        print(f"Error sending digest to user {user_id}: {e}")
+
+
+def _queue_digest(bot, user_id, window, message, embeds):
+    """Add an alert to a user's pending digest, starting its timer if needed"""
+    digest = _digests.get(user_id)
+    if digest is None:
+        digest = _digests[user_id] = {"messages": [], "embeds": []}
+        digest["task"] = asyncio.create_task(_flush_digest(bot, user_id, window))
+    if message:
+        digest["messages"].append(message)
+    digest["embeds"].extend(embeds)
+
+
+async def fan_out(bot, channels, dm_user_ids, message=None, embeds=(), digest_windows=None):
+    """Send a message and its embeds to every channel and DM user concurrently.
+
+    Embeds are packed up to 10 per message. DM users with a digest window
+    (seconds, from digest_windows) get the alert merged into one delayed
+    message instead. Sends are bounded by a semaphore and paced per route.
+    Returns the delivery time in seconds per recipient; failed and
+    digest recipients are left out.
+    """
+    start = time.monotonic()
+    timings = {}
+    digest_windows = digest_windows or {}
+
+    async def deliver(recipient, route, channel=None, user_id=None):
+        try:
+            async with _send_slots:
+                target = channel or await get_dm_channel(bot, user_id)
+                await _send(target, route, message, embeds)
+            timings[recipient] = time.monotonic() - start
+        except Exception as e:
+            if user_id is not None and isinstance(e, discord.NotFound):
+                forget(user_id)  # Persisted DM channel no longer exists
+            print(f"Error sending to {recipient}: {e}")
+
+    tasks = [deliver(f"channel {ch}", f"channel:{ch.id}", channel=ch) for ch in channels]
+    for user_id in dm_user_ids:
+        if digest_windows.get(user_id):
+            _queue_digest(bot, user_id, digest_windows[user_id], message, embeds)
+        else:
+            tasks.append(deliver(f"user {user_id}", f"dm:{user_id}", user_id=user_id))
+    await asyncio.gather(*tasks)
+
+    if tasks:
+        delays = sorted(timings.values())
+        last_fanout.update({
+            "recipients": len(tasks),
+            "delivered": len(delays),
+            "median": delays[len(delays) // 2] if delays else 0.0,
+            "slowest": delays[-1] if delays else 0.0,
+        })
+        print(f"Fan-out delivered to {len(delays)}/{len(tasks)} recipients, "
+              f"slowest after {last_fanout['slowest']:.2f}s")
+    return timings
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from curl_cffi import requests
+from http_client import get_session
+from queue_index import normalize
+from scheduler import studefi_schedule
+from studefi_parser import absolute_url, find_reservation_link, parse_form
+
+PREFETCH_INTERVAL = 60  # Seconds between prefetch passes
+LINK_TTL = 300  # Seconds a resolved reservation link is trusted
+FORM_TTL = 600  # Seconds a prefetched form 1 is trusted (PHP session lifetime)
+MAX_CONCURRENT = 4  # Residences prefetched at once
+
+_known_residences = {}  # Residence name -> listing link
+_reservation_links = {}  # Listing link -> (reservation link or None, expires_at)
+_forms = {}  # Listing link -> (reservation link, (hidden fields, action URL), cookies, expires_at)
+
+
+def update_known_residences(residences):
+    """Record the (name, link) pairs seen on the Studefi listing"""
+    for name, link in residences:
+        _known_residences[name] = link
+
+
+def get_prefetched_link(link):
+    """Return the cached reservation link of a residence, if still fresh"""
+    entry = _reservation_links.get(link)
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def take_prefetched_form(link):
+    """Pop the prefetched form 1 of a residence.
+
+    Returns (reservation link, (hidden fields, action URL), cookies) or None.
+    A form is tied to the Studefi session that fetched it, so it is handed
+    out once; later reservations for the same residence fetch their own.
+    """
+    entry = _forms.pop(link, None)
+    if entry and entry[3] > time.monotonic():
+        return entry[:3]
+    return None
+
+
+def _target_links(targets):
+    """Listing links of the residences whose normalized names are in targets"""
+    return {link for name, link in _known_residences.items() if normalize(name) in targets}
+
+
+async def _prefetch_form(link, reserver_link):
+    """Fetch form 1 in its own Studefi session and keep its hidden fields"""
+    session = requests.AsyncSession(impersonate="chrome")
+    try:
+        res = await session.get(reserver_link)
+        studefi_schedule.record_response(res.status_code, res.headers.get("Retry-After"))
+        if res.status_code != 200:
+            return
+        form = parse_form(res.text)
+        if form:
+            cookies = list(session.cookies.jar)
+            _forms[link] = (reserver_link, form, cookies, time.monotonic() + FORM_TTL)
+    finally:
+        await session.close()
+
+
+async def _prefetch_residence(link, slots):
+    async with slots:
+        await _resolve_residence(link)
+
+
+async def _resolve_residence(link):
+    now = time.monotonic()
+    entry = _reservation_links.get(link)
+    if entry and entry[1] > now:
+        reserver_link = entry[0]
+    else:
+        res = await get_session().get(absolute_url(link))
+        studefi_schedule.record_response(res.status_code, res.headers.get("Retry-After"))
+        if res.status_code != 200:
+            return
+        reserver_link = find_reservation_link(res.text)
+        _reservation_links[link] = (reserver_link, now + LINK_TTL)
+
+    # Studefi only shows the button on some residence pages; when it does,
+    # fetch form 1 too so a reservation can go straight to submission.
+    form = _forms.get(link)
+    if reserver_link and (not form or form[3] <= now + PREFETCH_INTERVAL):
+        await _prefetch_form(link, reserver_link)
+
+
+async def refresh(targets):
+    """Resolve the residences queued users can get ahead of availability.
+
+    targets holds normalized residence names, see QueueIndex.targeted_residences.
+    Requests count against the Studefi budget, at most MAX_CONCURRENT at a
+    time, and the pass is skipped while Studefi polling is backing off.
+    """
+    links = _target_links(targets)
+    for cache in (_reservation_links, _forms):
+        for link in list(cache):
+            if link not in links:
+                del cache[link]
+    if studefi_schedule.errors or studefi_schedule.retry_after:
+        return
+
+    slots = asyncio.Semaphore(MAX_CONCURRENT)
+    results = await asyncio.gather(
+        *(_prefetch_residence(link, slots) for link in links),
+        return_exceptions=True)
+    for link, result in zip(links, results):
+        if isinstance(result, Exception):
+            print(f"Error prefetching {link}: {result}")
@@ -0,0 +1,119 @@
+import bisect
+import heapq
+import itertools
+import unicodedata
+from datetime import datetime, timezone
+from async_db import add_to_queue, remove_from_queue
+
+FIRST_AVAILABLE = "first available"
+
+
+def normalize(text):
+    """Accent- and case-insensitive key for a residence name"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.casefold().split())
+
+
+class QueueIndex:
+    """In-memory view of studefi_queue for matching residences to users.
+
+    Each known residence maps to the queued users whose choice matches it,
+    kept in queue order (priority DESC, timestamp ASC), plus one bucket for
+    "First Available" users. Matching a residence is a dictionary lookup
+    and a lazy merge of two sorted lists instead of a scan of the queue.
+    """
+
+    def __init__(self):
+        self._seq = itertools.count()  # Tie-breaker for identical timestamps
+        self._entries = {}  # User ID -> (sort key, queue row)
+        self._by_residence = {}  # Normalized residence name -> [(sort key, queue row)]
+        self._first_available = []  # [(sort key, queue row)]
+        self._residences = set()  # Normalized names of every residence seen
+
+    def _matches(self, entry, residence_key):
+        choice = normalize(entry[1][1])
+        return choice in residence_key or residence_key in choice
+
+    def load(self, queue):
+        """Replace the index with rows from get_queue()"""
+        self.__init__()
+        for row in queue:
+            self.add(row)
+
+    def add(self, row):
+        """Index a (user_id, residence, email, timestamp, priority) row"""
+        user_id, residence, _, timestamp, priority = row
+        self.remove(user_id)
+        entry = ((-priority, timestamp, next(self._seq)), row)
+        self._entries[user_id] = entry
+        if normalize(residence) == FIRST_AVAILABLE:
+            bisect.insort(self._first_available, entry)
+            return
+        for residence_key in self._residences:
+            if self._matches(entry, residence_key):
+                bisect.insort(self._by_residence.setdefault(residence_key, []), entry)
+
+    def remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        buckets = [self._first_available] if normalize(entry[1][1]) == FIRST_AVAILABLE \
+            else self._by_residence.values()
+        for bucket in buckets:
+            i = bisect.bisect_left(bucket, entry)
+            if i < len(bucket) and bucket[i] is entry:
+                del bucket[i]
+
+    def update_residences(self, names):
+        """Register residence names; queued choices are matched once per new name"""
+        for name in names:
+            residence_key = normalize(name)
+            if residence_key in self._residences:
+                continue
+            self._residences.add(residence_key)
+            bucket = [entry for entry in self._entries.values()
+                      if normalize(entry[1][1]) != FIRST_AVAILABLE and self._matches(entry, residence_key)]
+            bucket.sort()
+            self._by_residence[residence_key] = bucket
+
+    def candidates(self, name):
+        """Queue rows that can be assigned to a residence, in queue order.
+
+        The buckets are snapshotted, so users added or removed while the
+        caller awaits between rows don't shift the iteration.
+        """
+        residence_key = normalize(name)
+        if residence_key not in self._residences:
+            self.update_residences([name])
+        bucket = tuple(self._by_residence.get(residence_key, ()))
+        for _, row in heapq.merge(bucket, tuple(self._first_available)):
+            yield row
+
+    def targeted_residences(self):
+        """Normalized names of residences at least one queued user can get"""
+        if self._first_available:
+            return set(self._residences)
+        return {key for key, bucket in self._by_residence.items() if bucket}
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+index = QueueIndex()
+
+
+async def enqueue(user_id, residence, email, priority=1):
+    """Add a user to studefi_queue and to the index"""
+    await add_to_queue(user_id, residence, email, priority)
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")  # As CURRENT_TIMESTAMP
+    index.add((user_id, residence, email, timestamp, priority))
+
+
+async def dequeue(user_id):
+    """Remove a user from studefi_queue and from the index"""
+    await remove_from_queue(user_id)
+    index.remove(user_id)
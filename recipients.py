@@ -0,0 +1,75 @@
+import asyncio
+import time
+from collections import OrderedDict
+import discord
+from async_db import get_all_dm_channels, save_dm_channel
+
+CACHE_SIZE = 5000  # DM channels kept in memory
+CACHE_TTL = 6 * 3600  # Seconds before a cached channel is looked up again
+
+_channels = OrderedDict()  # User ID -> (messageable, expires_at), in LRU order
+_channel_ids = None  # User ID -> persisted DM channel ID, loaded by load()
+_load_lock = asyncio.Lock()
+
+stats = {
+    "hits": 0,  # Served from memory or a persisted channel ID
+    "lookups": 0,  # Needed the gateway cache or REST
+}
+
+
+def _remember(user_id, channel):
+    _channels[user_id] = (channel, time.monotonic() + CACHE_TTL)
+    _channels.move_to_end(user_id)
+    while len(_channels) > CACHE_SIZE:
+        _channels.popitem(last=False)
+
+
+async def load():
+    """Load the persisted DM channel IDs once, however many lookups wait on it"""
+    global _channel_ids
+    async with _load_lock:
+        if _channel_ids is None:
+            _channel_ids = await get_all_dm_channels()
+
+
+async def get_dm_channel(bot, user_id):
+    """Return something we can .send() to in a user's DMs.
+
+    Tries the in-process LRU first, then the DM channel ID persisted in
+    the database (no REST call needed), then bot.get_user, and only falls
+    back to fetch_user on a complete miss.
+    """
+    entry = _channels.get(user_id)
+    if entry and entry[1] > time.monotonic():
+        _channels.move_to_end(user_id)
+        stats["hits"] += 1
+        return entry[0]
+
+    if _channel_ids is None:
+        await load()
+    channel_id = _channel_ids.get(user_id)
+    if channel_id:
+        stats["hits"] += 1
+        channel = bot.get_partial_messageable(channel_id, type=discord.ChannelType.private)
+        _remember(user_id, channel)
+        return channel
+
+    stats["lookups"] += 1
+    user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+    channel = user.dm_channel or await user.create_dm()
+    _channel_ids[user_id] = channel.id
+    await save_dm_channel(user_id, channel.id)
+    _remember(user_id, channel)
+    return channel
+
+
+def forget(user_id):
+    """Drop a user's cached DM channel, e.g. after a failed send"""
+    _channels.pop(user_id, None)
+    if _channel_ids:
+        _channel_ids.pop(user_id, None)
+
+
+def hit_rate():
+    total = stats["hits"] + stats["lookups"]
+    return stats["hits"] / total if total else 0.0
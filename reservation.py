@@ -1,20 +1,36 @@
 import asyncio
-import os
+import functools
+import time
 import curl_cffi
-from curl_cffi import requests
-from bs4 import BeautifulSoup
 import discord
-from db_manager import remove_from_queue
+from session_pool import reservation_pool
+from recipients import get_dm_channel
+from prefetch import get_prefetched_link, take_prefetched_form
+from async_db import claim_user, release_claim
+from executor import executor
+from queue_index import index as queue_index, dequeue, normalize, FIRST_AVAILABLE
+from studefi_parser import absolute_url, find_reservation_link, parse_form
 
 STUDEFI_URL = "https://www.studefi.fr/main.php"
 
-def ensure_dummy_pdf():
-    pdf_path = "dummy_id.pdf"
-    if not os.path.exists(pdf_path):
-        dummy_content = b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>\nendobj\nxref\n0 4\n0000000000 65535 f\n0000000009 00000 n\n0000000056 00000 n\n0000000111 00000 n\ntrailer\n<< /Size 4 /Root 1 0 R >>\nstartxref\n190\n%%EOF\n"
-        with open(pdf_path, 'wb') as f:
-            f.write(dummy_content)
-    return pdf_path
+RACE_FIRST_AVAILABLE = True  # Race "First Available" users across residences opened together
+RACE_WIDTH = 3  # Residences a single user races over at most
+
+FORM1_HIDDEN = ("tokenCSRF", "srv", "cdTemporaire", "cdEsi", "idDemandeLogement", "idLogement")
+FORM2_HIDDEN = FORM1_HIDDEN + ("etapePrecedente",)
+
+# Identity document sent with both steps, kept in memory instead of on disk
+DUMMY_PDF = b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>\nendobj\nxref\n0 4\n0000000000 65535 f\n0000000009 00000 n\n0000000056 00000 n\n0000000111 00000 n\ntrailer\n<< /Size 4 /Root 1 0 R >>\nstartxref\n190\n%%EOF\n"
+
+_claimed = set()  # Users this process holds a claim for
+_templates = {}  # User ID -> (email, step 1 payload, step 2 payload)
+
+dispatch_stats = {
+    "events": 0,  # Availability events with at least one new residence
+    "attempted": 0,  # Reservation attempts started, one per residence a user races over
+    "succeeded": 0,  # Reservations that reached the confirmation page
+    "last_event": (0, 0),  # (residences, reservation attempts) of the latest event
+}
 
 def generate_random_data(email):
     return {
@@ -75,200 +91,323 @@ def generate_random_data(email):
         "garant_autres_revenus": "0"
     }
 
-async def process_queue_for_residence(name, link, queue_users, bot):
-    """Attempt to reserve an apartment for the first matching user in queue."""
-    # Find matching user
-    target_user = None
-    for user_id, q_residence, email, _, _ in queue_users:
-        if q_residence.lower() == "first available" or q_residence.lower() in name.lower() or name.lower() in q_residence.lower():
-            target_user = (user_id, email)
-            break
-            
-    if target_user is None:
-        return
+def build_submission_template(email):
+    """Build both step payloads for an email, with the hidden form fields left empty"""
+    data = generate_random_data(email)
+    
+    payload1 = {
+        "tokenCSRF": "",
+        "srv": "",
+        "op": "saveEtape1",
+        "cdTemporaire": "",
+        "cdEsi": "",
+        "idDemandeLogement": "",
+        "idLogement": "",
+        "lbEmail": data["email"],
+        "lbCivilite": data["civilite"],
+        "lbNom": data["nom"],
+        "lbPrenom": data["prenom"],
+        "dtNaissance": data["date_naissance"],
+        "lbLieuNaissance": data["lieu_naissance"],
+        "cdSituationFamille": data["situation_famille"],
+        "lbAdresse": data["adresse"],
+        "cdPostal": data["code_postal"],
+        "lbVille": data["ville"],
+        "idPays": data["pays"],
+        "nbTelephone": data["telephone"],
+        "lbSituation": data["situation"],
+        "lbPrecisionSituation": "",
+        "lbTypeEtudes": data["etudes"],
+        "lbPrecisionTypeEtablissement": data["type_etablissement"],
+        "lbFiliere": data["filiere"],
+        "lbNomEtablissement": data["etablissement"],
+        "fgBoursier": data["boursier"],
+        "fgJobEtudiant": data["job"],
+        
+        # Colocataire Data
+        "lbEmailColocataire": data["coloc_email"],
+        "lbCiviliteColocataire": data["coloc_civilite"],
+        "lbNomColocataire": data["coloc_nom"],
+        "lbPrenomColocataire": data["coloc_prenom"],
+        "dtNaissanceColocataire": data["coloc_date_naissance"],
+        "lbLieuNaissanceColocataire": data["coloc_ville_naissance"],
+        "cdSituationFamilleColocataire": data["coloc_situation_famille"],
+        "lbAdresseColocataire": data["coloc_adresse"],
+        "cdPostalColocataire": data["coloc_cp"],
+        "lbVilleColocataire": data["coloc_ville"],
+        "idPaysColocataire": data["coloc_pays"],
+        "nbTelephoneColocataire": data["coloc_telephone"],
+        "lbSituationColocataire": data["coloc_situation"],
         
-    user_id, email = target_user
-    pdf_path = ensure_dummy_pdf()
-    session = requests.AsyncSession(impersonate="chrome")
+        "button": "Etape suivante"
+    }
+
+    payload2 = {
+        "tokenCSRF": "",
+        "srv": "",
+        "op": "saveEtape2",
+        "cdTemporaire": "",
+        "cdEsi": "",
+        "etapePrecedente": "",
+        "idDemandeLogement": "",
+        "idLogement": "",
+        "lbCiviliteGarant": data["civilite"],
+        "lbNomGarant": data["garant_nom"],
+        "lbPrenomGarant": data["garant_prenom"],
+        "dtNaissanceGarant": data["garant_date_naissance"],
+        "lbLieuNaissanceGarant": data["garant_lieu_naissance"],
+        "cdSituationFamilleGarant": data["situation_famille"],
+        "cdLienParenteGarant": data["garant_lien"],
+        "lbAdresseGarant": data["garant_adresse"],
+        "cdPostalGarant": data["garant_cp"],
+        "lbVilleGarant": data["garant_ville"],
+        "idPaysGarant": data["pays"],
+        "nbTelephoneGarant": data["garant_telephone"],
+        "lbEmailGarant": data["garant_email"],
+        "lbProfessionGarant": data["garant_profession"],
+        "nbPersonnesAChargeGarant": data["garant_personnes"],
+        "lbLocataireProprietaireGarant": data["garant_logement"],
+        "dtDebutProprietaireGarant": data["garant_depuis"],
+        "nbMontantLoyerGarant": data["garant_loyer"],
+        "nbRevenusGarant": data["garant_revenus"],
+        "nbMoisRevenusGarant": "12",
+        "lbPrecisionRevenusGarant": "CDI",
+        "nbChargesGarant": data["garant_charges"],
+        "nbAllocationsFamilialesGarant": data["garant_allocations"],
+        "nbAutresRevenusGarant": data["garant_autres_revenus"],
+        "button": "Etape suivante"
+    }
+    return payload1, payload2
+
+
+def prepare_submission(user_id, email):
+    """Build a queued user's payloads ahead of time so attempts only merge hidden fields"""
+    _templates[user_id] = (email,) + build_submission_template(email)
+
+
+def drop_submission(user_id):
+    _templates.pop(user_id, None)
+
+
+def _get_submission(user_id, email):
+    template = _templates.get(user_id)
+    if template is None or template[0] != email:
+        prepare_submission(user_id, email)
+        template = _templates[user_id]
+    return template[1], template[2]
+
+
+def _merge_hidden(template, form, hidden):
+    """Copy a payload template and fill in the hidden fields scraped from a form"""
+    payload = template.copy()
+    for field in hidden:
+        payload[field] = form.get(field, "")
+    return payload
+
+
+async def claim_next_user(name):
+    """Claim the first queued user for a residence who isn't already being served.
+
+    The claim is an INSERT into queue_claims, so a user can only be held by
+    one reservation at a time. Returns (user_id, residence choice, email) or None.
+    """
+    # Candidates are merged lazily and the loop stops at the first claim,
+    # so a busy queue costs only the users skipped. The index can change
+    # while a claim is awaited, hence the membership check.
+    for user_id, q_residence, email, _, _ in queue_index.candidates(name):
+        if user_id in _claimed or user_id not in queue_index:
+            continue
+        if await claim_user(user_id, name):
+            _claimed.add(user_id)
+            return user_id, q_residence, email
+    return None
+
+
+async def dispatch_reservations(residences, bot, detected_at=None):
+    """Reserve newly available residences in parallel, one different user each.
+
+    Each residence gets the first queued user not already claimed. A
+    "First Available" user also races over other residences of the event.
+    """
+    if detected_at is None:
+        detected_at = time.monotonic()
+
+    tasks = []
+    attempts = 0
+    for i, (name, link) in enumerate(residences):
+        target_user = await claim_next_user(name)
+        if target_user is None:
+            continue
+        user_id, q_residence, email = target_user
+        targets = [(name, link)]
+        if RACE_FIRST_AVAILABLE and normalize(q_residence) == FIRST_AVAILABLE:
+            # Any residence will do, so also try the others opened in this event
+            others = residences[i + 1:] + residences[:i]
+            targets += others[:RACE_WIDTH - 1]
+        attempts += len(targets)
+        tasks.append(asyncio.create_task(reserve_for_user(targets, user_id, email, bot, detected_at)))
+
+    dispatch_stats["events"] += 1
+    dispatch_stats["attempted"] += attempts
+    dispatch_stats["last_event"] = (len(residences), attempts)
+    print(f"Availability event: {len(residences)} residence(s), {attempts} reservation attempt(s) "
+          f"for {len(tasks)} user(s)")
+    results = await asyncio.gather(*tasks)
+    dispatch_stats["succeeded"] += sum(results)
+    return results
+
+
+async def attempt_reservation(name, link, user_id, email, detected_at, record):
+    """Run the Studefi forms for one residence; True if the confirmation page was reached.
+
+    Each HTTP step goes through executor.step, which applies the step
+    deadline and records its duration in record.
+    """
+    template1, template2 = _get_submission(user_id, email)
+    session = await reservation_pool.acquire()
+    failed = False
     
     try:
-        # Step 1: Parse Residence Page to get reservation link
-        residence_url = f"https://www.studefi.fr/{link}" if not link.startswith("http") else link
-        res = await session.get(residence_url)
-        soup = BeautifulSoup(res.text, "html.parser")
-        
-        reserver_link = None
-        for a in soup.find_all("a", class_="button mini-button"):
-            if "Réserver en ligne" in a.get_text() or "srv=Reservation" in a.get("href", ""):
-                reserver_link = a.get("href")
-                break
+        prefetched = take_prefetched_form(link)
+        if prefetched:
+            # Form 1 was already fetched while the residence was unavailable
+            reserver_link, form1, cookies = prefetched
+            for cookie in cookies:
+                session.cookies.jar.set_cookie(cookie)
+            print(f"[{email}] Started reservation for {name} with prefetched form: {reserver_link}")
+        else:
+            # Step 1: Parse Residence Page to get reservation link
+            reserver_link = get_prefetched_link(link)
+            if not reserver_link:
+                res = await executor.step(record, "residence page", session.get(absolute_url(link)))
+                reserver_link = find_reservation_link(res.text)
+                    
+            if not reserver_link:
+                print(f"No reservation button found for {name}")
+                record["error"] = "No reservation button"
+                return False
                 
-        if not reserver_link:
-            print(f"No reservation button found for {name}")
-            return
+            print(f"[{email}] Started reservation for {name}: {reserver_link}")
             
-        if not reserver_link.startswith("http"):
-            reserver_link = f"https://www.studefi.fr/{reserver_link.lstrip('/')}"
+            # Step 2: GET Studefi_1.html to extract hidden fields
+            res1 = await executor.step(record, "form 1", session.get(reserver_link))
+            form1 = parse_form(res1.text)
+            if not form1:
+                print("Form 1 not found.")
+                record["error"] = "Form 1 not found"
+                return False
+        form1, action_url1 = form1
             
-        print(f"[{email}] Started reservation for {name}: {reserver_link}")
+        payload1 = _merge_hidden(template1, form1, FORM1_HIDDEN)
         
-        # Step 2: GET Studefi_1.html to extract hidden fields
-        res1 = await session.get(reserver_link)
-        soup1 = BeautifulSoup(res1.text, "html.parser")
-        form1 = soup1.find("form", id="form1")
-        if not form1:
-            print("Form 1 not found.")
-            return
-            
-        def get_hidden_val(soup_form, field_name):
-            inp = soup_form.find("input", {"name": field_name})
-            return inp.get("value", "") if inp else ""
-            
-        data = generate_random_data(email)
-        
-        payload1 = {
-            "tokenCSRF": get_hidden_val(form1, "tokenCSRF"),
-            "srv": get_hidden_val(form1, "srv"),
-            "op": "saveEtape1",
-            "cdTemporaire": get_hidden_val(form1, "cdTemporaire"),
-            "cdEsi": get_hidden_val(form1, "cdEsi"),
-            "idDemandeLogement": get_hidden_val(form1, "idDemandeLogement"),
-            "idLogement": get_hidden_val(form1, "idLogement"),
-            "lbEmail": data["email"],
-            "lbCivilite": data["civilite"],
-            "lbNom": data["nom"],
-            "lbPrenom": data["prenom"],
-            "dtNaissance": data["date_naissance"],
-            "lbLieuNaissance": data["lieu_naissance"],
-            "cdSituationFamille": data["situation_famille"],
-            "lbAdresse": data["adresse"],
-            "cdPostal": data["code_postal"],
-            "lbVille": data["ville"],
-            "idPays": data["pays"],
-            "nbTelephone": data["telephone"],
-            "lbSituation": data["situation"],
-            "lbPrecisionSituation": "",
-            "lbTypeEtudes": data["etudes"],
-            "lbPrecisionTypeEtablissement": data["type_etablissement"],
-            "lbFiliere": data["filiere"],
-            "lbNomEtablissement": data["etablissement"],
-            "fgBoursier": data["boursier"],
-            "fgJobEtudiant": data["job"],
-            
-            # Colocataire Data
-            "lbEmailColocataire": data["coloc_email"],
-            "lbCiviliteColocataire": data["coloc_civilite"],
-            "lbNomColocataire": data["coloc_nom"],
-            "lbPrenomColocataire": data["coloc_prenom"],
-            "dtNaissanceColocataire": data["coloc_date_naissance"],
-            "lbLieuNaissanceColocataire": data["coloc_ville_naissance"],
-            "cdSituationFamilleColocataire": data["coloc_situation_famille"],
-            "lbAdresseColocataire": data["coloc_adresse"],
-            "cdPostalColocataire": data["coloc_cp"],
-            "lbVilleColocataire": data["coloc_ville"],
-            "idPaysColocataire": data["coloc_pays"],
-            "nbTelephoneColocataire": data["coloc_telephone"],
-            "lbSituationColocataire": data["coloc_situation"],
-            
-            "button": "Etape suivante"
-        }
-        
-        action_url1 = form1.get("action")
-        if not action_url1:
-            action_url1 = "https://www.studefi.fr/main.php"
-        elif not action_url1.startswith("http"):
-            action_url1 = f"https://www.studefi.fr/{action_url1.lstrip('/')}"
-            
         mp1 = curl_cffi.CurlMime()
-        mp1.addpart(name="pieceIdentite", content_type="application/pdf", filename="piece.pdf", local_path=pdf_path)
+        mp1.addpart(name="pieceIdentite", content_type="application/pdf", filename="piece.pdf", data=DUMMY_PDF)
             
-        submit1 = await session.post(
-            action_url1,
-            data=payload1,
-            multipart=mp1
-        )
-        mp1.close()
+        try:
+            submit1 = await executor.step(record, "step 1 submit", session.post(
+                action_url1,
+                data=payload1,
+                multipart=mp1
+            ))
+        finally:
+            mp1.close()
+        print(f"[{email}] Step 1 submitted {(time.monotonic() - detected_at) * 1000:.0f} ms after detection")
             
         # Step 3: Parse Studefi_2.html
-        soup2 = BeautifulSoup(submit1.text, "html.parser")
-        form2 = soup2.find("form", id="form1")
+        form2 = parse_form(submit1.text)
         if not form2:
             print("Form 2 not found.")
-            return
+            record["error"] = "Form 2 not found"
+            return False
+        form2, action_url2 = form2
             
-        payload2 = {
-            "tokenCSRF": get_hidden_val(form2, "tokenCSRF"),
-            "srv": get_hidden_val(form2, "srv"),
-            "op": "saveEtape2",
-            "cdTemporaire": get_hidden_val(form2, "cdTemporaire"),
-            "cdEsi": get_hidden_val(form2, "cdEsi"),
-            "etapePrecedente": get_hidden_val(form2, "etapePrecedente"),
-            "idDemandeLogement": get_hidden_val(form2, "idDemandeLogement"),
-            "idLogement": get_hidden_val(form2, "idLogement"),
-            "lbCiviliteGarant": data["civilite"],
-            "lbNomGarant": data["garant_nom"],
-            "lbPrenomGarant": data["garant_prenom"],
-            "dtNaissanceGarant": data["garant_date_naissance"],
-            "lbLieuNaissanceGarant": data["garant_lieu_naissance"],
-            "cdSituationFamilleGarant": data["situation_famille"],
-            "cdLienParenteGarant": data["garant_lien"],
-            "lbAdresseGarant": data["garant_adresse"],
-            "cdPostalGarant": data["garant_cp"],
-            "lbVilleGarant": data["garant_ville"],
-            "idPaysGarant": data["pays"],
-            "nbTelephoneGarant": data["garant_telephone"],
-            "lbEmailGarant": data["garant_email"],
-            "lbProfessionGarant": data["garant_profession"],
-            "nbPersonnesAChargeGarant": data["garant_personnes"],
-            "lbLocataireProprietaireGarant": data["garant_logement"],
-            "dtDebutProprietaireGarant": data["garant_depuis"],
-            "nbMontantLoyerGarant": data["garant_loyer"],
-            "nbRevenusGarant": data["garant_revenus"],
-            "nbMoisRevenusGarant": "12",
-            "lbPrecisionRevenusGarant": "CDI",
-            "nbChargesGarant": data["garant_charges"],
-            "nbAllocationsFamilialesGarant": data["garant_allocations"],
-            "nbAutresRevenusGarant": data["garant_autres_revenus"],
-            "button": "Etape suivante"
-        }
+        payload2 = _merge_hidden(template2, form2, FORM2_HIDDEN)
         
-        action_url2 = form2.get("action")
-        if not action_url2:
-            action_url2 = "https://www.studefi.fr/main.php"
-        elif not action_url2.startswith("http"):
-            action_url2 = f"https://www.studefi.fr/{action_url2.lstrip('/')}"
-            
         mp2 = curl_cffi.CurlMime()
-        mp2.addpart(name="pieceIdentiteGarant", content_type="application/pdf", filename="pieceGarant.pdf", local_path=pdf_path)
+        mp2.addpart(name="pieceIdentiteGarant", content_type="application/pdf", filename="pieceGarant.pdf", data=DUMMY_PDF)
             
-        submit2 = await session.post(
-            action_url2,
-            data=payload2,
-            multipart=mp2
-        )
-        mp2.close()
+        try:
+            submit2 = await executor.step(record, "step 2 submit", session.post(
+                action_url2,
+                data=payload2,
+                multipart=mp2
+            ))
+        finally:
+            mp2.close()
             
         # Step 4: Verification
         success_marker = 'value="Valider ma demande"'
         if success_marker in submit2.text:
-            print(f"[{email}] Successfully reached confirmation page!")
-            # Remove from queue
-            remove_from_queue(user_id)
-            
-            # Notify User
-            user_target = await bot.fetch_user(user_id)
-            if user_target:
-                embed = discord.Embed(
-                    title="🎉 Studefi Reservation Successful!",
-                    description=f"Your automated reservation on **{name}** has been submitted.",
-                    color=0x00ff00
-                )
-                embed.add_field(name="Next Steps", value="Check your email for the confirmation link from Studefi!", inline=False)
-                await user_target.send(embed=embed)
-        else:
-            print(f"[{email}] Reservation incomplete, still on step 2 or error.")
+            print(f"[{email}] Successfully reached confirmation page for {name}!")
+            record["stage"] = "confirmation page"
+            return True
+        print(f"[{email}] Reservation incomplete for {name}, still on step 2 or error.")
+        record["error"] = "Confirmation page not reached"
+        return False
 
+    except asyncio.CancelledError:
+        failed = True  # Lost a race or hit a deadline; the session may be mid-request
+        raise
     except Exception as e:
-        print(f"Exception during reservation for {user_id}: {e}")
+        failed = True
+        print(f"[{email}] Exception during reservation for {name}: {e}")
+        record["error"] = record["error"] or str(e)
+        return False
     finally:
-        await session.close()
+        # Re-priming the session is a request of its own: keep it off the
+        # attempt's deadline so a confirmed reservation returns right away
+        executor.spawn(reservation_pool.release(session, discard=failed))
+
+
+async def notify_success(name, user_id, bot):
+    """Remove a user from the queue and tell them their reservation went through"""
+    await dequeue(user_id)
+    drop_submission(user_id)
+    user_target = await get_dm_channel(bot, user_id)
+    if user_target:
+        embed = discord.Embed(
+            title="🎉 Studefi Reservation Successful!",
+            description=f"Your automated reservation on **{name}** has been submitted.",
+            color=0x00ff00
+        )
+        embed.add_field(name="Next Steps", value="Check your email for the confirmation link from Studefi!", inline=False)
+        await user_target.send(embed=embed)
+
+
+async def reserve_for_user(targets, user_id, email, bot, detected_at=None):
+    """Reserve one of the (name, link) targets for a user claimed by the dispatcher.
+
+    With several targets, the attempts race: the first one to reach the
+    confirmation page wins and the others are cancelled. Returns True on
+    success; otherwise the user's claim is released so they can be picked
+    for the next residence.
+    """
+    attempts = {}
+    for name, link in targets:
+        attempt = functools.partial(attempt_reservation, name, link, user_id, email, detected_at)
+        attempts[asyncio.create_task(executor.run(name, email, attempt))] = name
+    winner = None
+    try:
+        pending = set(attempts)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result() and winner is None:
+                    winner = attempts[task]
+    finally:
+        for task in attempts:
+            task.cancel()
+        await asyncio.gather(*attempts, return_exceptions=True)
+        _claimed.discard(user_id)
+        if winner is None:
+            await release_claim(user_id)
+
+    if len(targets) > 1:
+        print(f"[{email}] Race over {len(targets)} residences won by {winner}" if winner
+              else f"[{email}] Race over {len(targets)} residences failed")
+    if winner is not None:
+        try:
+            await notify_success(winner, user_id, bot)
+        except Exception as e:
+            print(f"Exception confirming reservation for {user_id}: {e}")
+    return winner is not None
\ No newline at end of file
@@ -0,0 +1,103 @@
+import random
+import time
+from collections import deque
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+TIMEZONE = ZoneInfo("Europe/Paris")
+
+# (start, end) local times when listings usually get published
+CROUS_HOT_WINDOWS = [("08:45", "10:30"), ("13:45", "15:00"), ("17:45", "19:00")]
+STUDEFI_HOT_WINDOWS = [("08:45", "12:00"), ("13:45", "18:00")]
+
+MAX_BACKOFF = 300  # Seconds
+RATE_LIMIT_BACKOFF = 60  # Seconds when a 429 carries no Retry-After
+
+
+class PollSchedule:
+    """Adaptive cadence for one polling source.
+
+    The delay before the next poll depends on whether we are in a hot
+    window, on consecutive errors and 429s (exponential backoff), and on
+    the requests already spent from the hourly budget. A random jitter is
+    applied so polls don't line up with the remote side's caches.
+    """
+
+    def __init__(self, name, interval, hot_interval, hot_windows=(), jitter=0.2, hourly_budget=3600):
+        self.name = name
+        self.interval = interval
+        self.hot_interval = hot_interval
+        self.hot_windows = [
+            (datetime.strptime(start, "%H:%M").time(), datetime.strptime(end, "%H:%M").time())
+            for start, end in hot_windows
+        ]
+        self.jitter = jitter
+        self.hourly_budget = hourly_budget
+        self.errors = 0
+        self.retry_after = 0.0  # Seconds requested by the server after a 429
+        self.last_delay = interval
+        self._requests = deque()  # Monotonic timestamps of requests in the last hour
+
+    def in_hot_window(self, now=None):
+        now = (now or datetime.now(TIMEZONE)).time()
+        return any(start <= now < end for start, end in self.hot_windows)
+
+    def requests_last_hour(self):
+        cutoff = time.monotonic() - 3600
+        while self._requests and self._requests[0] < cutoff:
+            self._requests.popleft()
+        return len(self._requests)
+
+    def record_response(self, status_code, retry_after=None):
+        """Account for one HTTP request made for this source"""
+        self._requests.append(time.monotonic())
+        if status_code == 429:
+            self.errors += 1
+            try:
+                self.retry_after = float(retry_after)
+            except (TypeError, ValueError):
+                self.retry_after = min(RATE_LIMIT_BACKOFF * self.errors, MAX_BACKOFF)
+        elif status_code >= 400:
+            self.errors += 1
+        else:
+            self.errors = 0
+            self.retry_after = 0.0
+
+    def record_error(self):
+        """Account for a poll that failed without an HTTP status"""
+        self.errors += 1
+
+    def next_delay(self):
+        """Seconds to wait before the next poll"""
+        base = self.hot_interval if self.in_hot_window() else self.interval
+        delay = base
+        if self.errors:
+            delay = min(base * 2 ** self.errors, MAX_BACKOFF)
+
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        # Jitter must not bring the next poll inside the server's Retry-After window
+        delay = max(delay, self.retry_after)
+
+        used = self.requests_last_hour()
+        if used >= self.hourly_budget:
+            # Out of budget: wait until the oldest request leaves the window
+            delay = max(delay, self._requests[0] + 3600 - time.monotonic())
+        elif used >= self.hourly_budget * 0.8:
+            delay *= 2
+        self.last_delay = max(delay, 0.5)
+        return self.last_delay
+
+    def describe(self):
+        """Human readable cadence for !status"""
+        text = f"~{self.last_delay:.1f}s"
+        if self.errors:
+            text += f" (backing off after {self.errors} error(s))"
+        elif self.in_hot_window():
+            text += " (hot window)"
+        return f"{text}, {self.requests_last_hour()}/{self.hourly_budget} req/h"
+
+
+crous_schedule = PollSchedule("CROUS", interval=5, hot_interval=2,
+                              hot_windows=CROUS_HOT_WINDOWS, hourly_budget=3600)
+studefi_schedule = PollSchedule("Studefi", interval=5, hot_interval=2,
+                                hot_windows=STUDEFI_HOT_WINDOWS, hourly_budget=2400)
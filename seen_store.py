@@ -0,0 +1,104 @@
+import time
+from async_db import get_seen, update_seen
+
+GONE_AFTER = 15 * 60  # Seconds an item must be missing from complete polls before it counts as gone
+SEEN_TTL = 24 * 3600  # Seconds before an item no poll has seen is evicted, even after incomplete polls
+PERSIST_EVERY = 5 * 60  # Seconds between last-seen writes for an item that stays listed
+
+
+class SeenStore:
+    """Items already announced for one source, tolerant to listings flapping.
+
+    Each item keeps the time it was last seen. One that drops out of a poll
+    (pagination shift, API blip) and comes back within gone_after is not
+    announced again. Items unseen for ttl are evicted so memory stays
+    bounded when polls are incomplete. Items can also carry a digest of
+    their alert fields, so a listing that changes is reported as changed.
+    State is persisted in seen_items.
+    """
+
+    def __init__(self, source, gone_after=GONE_AFTER, ttl=SEEN_TTL):
+        self.source = source
+        self.gone_after = gone_after
+        self.ttl = max(ttl, gone_after)
+        self.baseline_pending = False  # Next poll only records a baseline, without alerts
+        self._last_seen = {}  # Item ID -> time of the last poll that listed it
+        self._digests = {}  # Item ID -> digest of its alert fields, if any
+        self._persisted = {}  # Item ID -> (last-seen time, digest) stored in the database
+        self._removed = set()  # Evicted items not yet deleted from the database
+        self._stored = False  # Whether the source exists in the database
+        self._last_poll = None
+
+    async def load(self):
+        """Restore the store from the database; a source never saved gets a silent baseline"""
+        rows = await get_seen(self.source)
+        self._stored = rows is not None
+        self.baseline_pending = not self._stored
+        rows = rows or {}
+        self._last_seen = {item_id: last_seen for item_id, (last_seen, _) in rows.items()}
+        self._digests = {item_id: digest for item_id, (_, digest) in rows.items() if digest is not None}
+        self._persisted = dict(rows)
+        self._removed = set()
+
+    def update(self, current, complete=True, now=None):
+        """Record the items listed by a poll and return (new IDs, changed IDs).
+
+        current is an iterable of item IDs, or a dict of item ID -> digest
+        to also detect changed items. Absence is only trusted from complete
+        polls: after an incomplete one items are kept until ttl instead of
+        gone_after.
+        """
+        if now is None:
+            now = time.time()
+        digests = current if isinstance(current, dict) else {}
+        new = []
+        changed = []
+        for item_id in current:
+            if item_id not in self._last_seen:
+                new.append(item_id)
+                self._removed.discard(item_id)
+            elif item_id in digests and self._digests.get(item_id, digests[item_id]) != digests[item_id]:
+                changed.append(item_id)
+            self._last_seen[item_id] = now
+        self._digests.update(digests)
+
+        expiry = self.gone_after if complete else self.ttl
+        for item_id, last_seen in list(self._last_seen.items()):
+            if now - last_seen > expiry:
+                del self._last_seen[item_id]
+                self._digests.pop(item_id, None)
+                self._persisted.pop(item_id, None)
+                self._removed.add(item_id)
+        self._last_poll = now
+
+        if self.baseline_pending:
+            self.baseline_pending = False
+            print(f"{self.source} baseline recorded: {len(current)} item(s), no alerts sent")
+            return [], []
+        return new, changed
+
+    async def save(self):
+        """Write new or changed items, stale last-seen times and evictions to the database"""
+        changed = []
+        for item_id, last_seen in self._last_seen.items():
+            stored = self._persisted.get(item_id)
+            digest = self._digests.get(item_id)
+            if stored is None or last_seen - stored[0] >= PERSIST_EVERY or digest != stored[1]:
+                changed.append((item_id, last_seen, digest))
+        if not changed and not self._removed and self._stored:
+            return
+        removed, self._removed = self._removed, set()
+        await update_seen(self.source, changed, removed)
+        for item_id, last_seen, digest in changed:
+            self._persisted[item_id] = (last_seen, digest)
+        self._stored = True
+
+    def present(self):
+        """Number of items listed by the latest poll"""
+        return sum(1 for last_seen in self._last_seen.values() if last_seen == self._last_poll)
+
+    def __contains__(self, item_id):
+        return item_id in self._last_seen
+
+    def __len__(self):
+        return len(self._last_seen)
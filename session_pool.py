@@ -0,0 +1,132 @@
+import asyncio
+import time
+from curl_cffi import requests
+
+STUDEFI_URL = "https://www.studefi.fr/main.php"
+
+POOL_SIZE = 3  # Warm sessions kept ready for reservations
+KEEPALIVE_INTERVAL = 45  # Seconds between keep-warm requests
+MAX_IDLE = 240  # Seconds before an unused session is considered stale
+PRIME_TIMEOUT = 15  # Seconds allowed for a cookie-priming or keep-warm request
+
+
+class SessionPool:
+    """Pool of pre-connected, cookie-primed Studefi sessions.
+
+    Reservations check out a session whose TCP/TLS connection to Studefi is
+    already open, so the first request of a reservation skips DNS, connect
+    and handshake. Idle sessions are kept warm by periodic HEAD requests.
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = []  # [(session, last_used)]
+        self._filling = 0
+        self.warm_hits = 0
+        self.cold_misses = 0
+
+    async def _new_session(self):
+        """Create a session and prime it with Studefi cookies"""
+        session = requests.AsyncSession(impersonate="chrome")
+        try:
+            await session.get(STUDEFI_URL, timeout=PRIME_TIMEOUT)
+        except Exception as e:
+            await session.close()
+            raise e
+        return session
+
+    async def acquire(self):
+        """Check out a warm session, or open a cold one if none is ready"""
+        if self._idle:
+            session, _ = self._idle.pop()
+            self.warm_hits += 1
+            return session
+        self.cold_misses += 1
+        return requests.AsyncSession(impersonate="chrome")
+
+    async def release(self, session, discard=False):
+        """Return a session to the pool once a reservation is done.
+
+        Cookies are cleared so the next reservation starts with a fresh
+        Studefi session while the underlying connection stays open. This
+        makes a request, so reservations run it in the background.
+        """
+        if discard or len(self._idle) >= self.size:
+            await session.close()
+            return
+        session.cookies.clear()
+        try:
+            await session.get(STUDEFI_URL, timeout=PRIME_TIMEOUT)
+        except asyncio.CancelledError:
+            await session.close()  # Shutdown while priming
+            raise
+        except Exception:
+            await session.close()
+            return
+        self._idle.append((session, time.monotonic()))
+
+    async def fill(self):
+        """Open sessions until the pool is full"""
+        missing = self.size - len(self._idle) - self._filling
+        if missing <= 0:
+            return
+        self._filling += missing
+        try:
+            results = await asyncio.gather(
+                *(self._new_session() for _ in range(missing)),
+                return_exceptions=True)
+        finally:
+            self._filling -= missing
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error opening pooled Studefi session: {result}")
+            elif len(self._idle) < self.size:
+                self._idle.append((result, time.monotonic()))
+            else:
+                await result.close()
+
+    async def keep_warm(self):
+        """Ping idle sessions so their connections stay open, then top up"""
+        now = time.monotonic()
+        for entry in list(self._idle):
+            session, last_used = entry
+            if entry not in self._idle:
+                continue  # Checked out while we were pinging another one
+            stale = now - last_used > MAX_IDLE
+            if stale:
+                # Take stale sessions out while their cookies are renewed
+                self._idle.remove(entry)
+            try:
+                if stale:
+                    session.cookies.clear()
+                    await session.get(STUDEFI_URL, timeout=PRIME_TIMEOUT)
+                    self._idle.append((session, time.monotonic()))
+                else:
+                    await session.head(STUDEFI_URL, timeout=PRIME_TIMEOUT)
+            except Exception as e:
+                print(f"Dropping pooled Studefi session: {e}")
+                if entry in self._idle:
+                    self._idle.remove(entry)
+                    await session.close()
+                elif stale:
+                    await session.close()
+        await self.fill()
+
+    async def close(self):
+        """Close every idle session"""
+        idle, self._idle = self._idle, []
+        for session, _ in idle:
+            await session.close()
+
+    def stats(self):
+        """Return pool usage counters"""
+        total = self.warm_hits + self.cold_misses
+        return {
+            "idle": len(self._idle),
+            "warm_hits": self.warm_hits,
+            "cold_misses": self.cold_misses,
+            "warm_rate": self.warm_hits / total if total else 0.0,
+        }
+
+
+reservation_pool = SessionPool()
@@ -0,0 +1,60 @@
+import hashlib
+import time
+from http_client import get_session
+from scheduler import studefi_schedule
+from studefi_parser import STUDEFI_URL, parse_listing
+
+_last_digest = None
+_last_result = None
+_last_parse_time = 0.0
+_validators = {}  # Conditional request headers for the cached page
+
+stats = {
+    "polls": 0,
+    "not_modified": 0,  # Server answered 304
+    "hash_hits": 0,  # Body identical to the cached one
+    "parse_time_saved": 0.0,  # Seconds of parsing skipped
+}
+
+
+async def fetch_listing():
+    """Fetch the Studefi listing as [(name, link, available)].
+
+    The last parsed result is reused when the server answers 304 to our
+    ETag/Last-Modified validators or when the body hashes to the same
+    digest, so unchanged pages are never parsed twice.
+    Returns None if the request failed.
+    """
+    global _last_digest, _last_result, _last_parse_time, _validators
+    stats["polls"] += 1
+
+    headers = _validators if _last_result is not None else {}
+    response = await get_session().get(STUDEFI_URL, headers=headers)
+    studefi_schedule.record_response(response.status_code, response.headers.get("Retry-After"))
+    if response.status_code == 304 and _last_result is not None:
+        stats["not_modified"] += 1
+        stats["parse_time_saved"] += _last_parse_time
+        return _last_result
+    if response.status_code != 200:
+        print(f"Studefi request failed with status: {response.status_code}")
+        return None
+
+    validators = {}
+    if response.headers.get("ETag"):
+        validators["If-None-Match"] = response.headers["ETag"]
+    if response.headers.get("Last-Modified"):
+        validators["If-Modified-Since"] = response.headers["Last-Modified"]
+    _validators = validators
+
+    digest = hashlib.blake2b(response.content, digest_size=16).digest()
+    if digest == _last_digest:
+        stats["hash_hits"] += 1
+        stats["parse_time_saved"] += _last_parse_time
+        return _last_result
+
+    start = time.perf_counter()
+    result = parse_listing(response.text)
+    _last_parse_time = time.perf_counter() - start
+    _last_digest = digest
+    _last_result = result
+    return result
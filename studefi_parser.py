@@ -0,0 +1,170 @@
+from html.parser import HTMLParser
+
+STUDEFI_URL = "https://www.studefi.fr/main.php"
+
+# The extractors below stream the page through html.parser events and only
+# keep the few fields we need, instead of building a full BeautifulSoup tree.
+
+
+def absolute_url(href, default=STUDEFI_URL):
+    """Turn a Studefi href into an absolute URL"""
+    if not href:
+        return default
+    if href.startswith("http"):
+        return href
+    return f"https://www.studefi.fr/{href.lstrip('/')}"
+
+
+class _StopParsing(Exception):
+    """Raised by an extractor once it has everything it needs"""
+
+
+def _classes(attrs):
+    return (attrs.get("class") or "").split()
+
+
+class _ListingExtractor(HTMLParser):
+    """Collect (name, link, available) from div.col-sm-6.list-res-elem blocks"""
+
+    def __init__(self):
+        super().__init__()
+        self.residences = []
+        self._depth = 0  # Open divs inside the current residence block
+        self._link_depth = 0  # Open divs inside its first div.list-res-link
+        self._link_seen = False
+        self._in_a = False
+        self._href = None
+        self._text = []
+        self._available = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth == 0:
+            if tag == "div":
+                classes = _classes(dict(attrs))
+                if "list-res-elem" in classes and "col-sm-6" in classes:
+                    self._depth = 1
+                    self._link_seen = False
+                    self._href = None
+                    self._text = []
+                    self._available = None
+            return
+
+        if tag == "div":
+            self._depth += 1
+            if self._link_depth:
+                self._link_depth += 1
+            elif not self._link_seen and "list-res-link" in _classes(dict(attrs)):
+                self._link_seen = True
+                self._link_depth = 1
+        elif tag == "a":
+            if self._link_depth and self._href is None:
+                self._in_a = True
+                self._href = dict(attrs).get("href") or ""
+        elif tag == "img" and self._available is None:
+            attrs = dict(attrs)
+            if "dispoRes" in _classes(attrs):
+                self._available = "non_disponibles" not in (attrs.get("src") or "")
+
+    def handle_endtag(self, tag):
+        if self._depth == 0:
+            return
+        if tag == "a":
+            self._in_a = False
+        elif tag == "div":
+            if self._link_depth:
+                self._link_depth -= 1
+            self._depth -= 1
+            if self._depth == 0 and self._href is not None:
+                name = "".join(part.strip() for part in self._text)
+                self.residences.append((name, self._href, bool(self._available)))
+
+    def handle_data(self, data):
+        if self._in_a:
+            self._text.append(data)
+
+
+class _ReservationLinkExtractor(HTMLParser):
+    """Find the first a.button.mini-button that leads to the reservation form"""
+
+    def __init__(self):
+        super().__init__()
+        self.link = None
+        self._href = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        classes = _classes(attrs)
+        if "button" in classes and "mini-button" in classes:
+            self._href = attrs.get("href") or ""
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._href is not None:
+            if "Réserver en ligne" in "".join(self._text) or "srv=Reservation" in self._href:
+                self.link = self._href
+                raise _StopParsing
+            self._href = None
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+
+class _FormExtractor(HTMLParser):
+    """Collect the input values and action of the form with a given id"""
+
+    def __init__(self, form_id):
+        super().__init__()
+        self.form_id = form_id
+        self.found = False
+        self.action = None
+        self.fields = {}
+        self._inside = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "form" and not self.found:
+            attrs = dict(attrs)
+            if attrs.get("id") == self.form_id:
+                self.found = True
+                self._inside = True
+                self.action = attrs.get("action")
+        elif tag == "input" and self._inside:
+            attrs = dict(attrs)
+            name = attrs.get("name")
+            if name and name not in self.fields:
+                self.fields[name] = attrs.get("value") or ""
+
+    def handle_endtag(self, tag):
+        if tag == "form" and self._inside:
+            raise _StopParsing
+
+
+def _run(extractor, html):
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except _StopParsing:
+        pass
+    return extractor
+
+
+def find_reservation_link(html):
+    """Return the absolute "Réserver en ligne" link of a residence page, if any"""
+    link = _run(_ReservationLinkExtractor(), html).link
+    return absolute_url(link) if link else None
+
+
+def parse_form(html, form_id="form1"):
+    """Return (hidden input values, absolute action URL) of a form, or None"""
+    extractor = _run(_FormExtractor(form_id), html)
+    if not extractor.found:
+        return None
+    return extractor.fields, absolute_url(extractor.action)
+
+
+def parse_listing(html):
+    """Return [(name, link, available)] for every residence on the Studefi listing"""
+    return _run(_ListingExtractor(), html).residences
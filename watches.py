@@ -0,0 +1,44 @@
+from queue_index import normalize
+
+WATCH_ALL = ""  # Watch key of "!watch all", contained in every residence name
+MAX_WATCHES = 10  # Watched residences per guild or DM user
+
+
+def watch_key(residence):
+    """Normalized key a watch is stored and matched under"""
+    return WATCH_ALL if normalize(residence) == "all" else normalize(residence)
+
+
+class WatchIndex:
+    """Studefi residence name -> subscribers watching it.
+
+    A watch matches a residence when one normalized name contains the
+    other, like !queue choices. Matches are computed once per residence
+    name against the distinct watch keys and cached, so routing an
+    availability event is a dictionary lookup.
+    """
+
+    def __init__(self):
+        self._watchers = {}  # Watch key -> set of subscribers
+        self._matches = {}  # Normalized residence name -> frozenset of subscribers
+
+    def build(self, watches):
+        """Index a dict of subscriber -> iterable of watch keys"""
+        self._watchers = {}
+        self._matches = {}
+        for subscriber, keys in watches.items():
+            for key in keys:
+                self._watchers.setdefault(key, set()).add(subscriber)
+
+    def watchers(self, name):
+        """Subscribers watching a residence"""
+        residence_key = normalize(name)
+        subscribers = self._matches.get(residence_key)
+        if subscribers is None:
+            subscribers = frozenset().union(*(group for key, group in self._watchers.items()
+                                              if key in residence_key or residence_key in key))
+            self._matches[residence_key] = subscribers
+        return subscribers
+
+    def __len__(self):
+        return len(self._watchers)